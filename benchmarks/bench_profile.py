@@ -0,0 +1,66 @@
+"""Compare the built-in profile engine with metaseq.
+
+Takes a bed file and a bam file, extracts coverage profiles of +/- window
+around the center of the sites with util_profile.profile_bam and with
+metaseq's genomic_signal(...).array(...), and reports run time of both and
+the difference between the two matrices.
+
+Usage:
+   bench_profile.py [options] <bed_file> <bam_file>
+
+Options:
+    --window=<window-size>  Size of genomic locations [default: 1000].
+    --Ref_ver=<ref_ver>     Reference genome version [default: hg19].
+    --fragment=<frag-size>  Size of fragment size by which each read is extended toward 3'end [default: None].
+    --binsize=<bin-size>    Number of bins to which coverages in each genomic coordiates are summurized [default: 100].
+    --maxSite=<maxsite>  Number of sites to be used [default: 50000].
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from docopt import docopt
+import ast
+import time
+import numpy as np
+import pybedtools
+from util_sites import prepare_sites
+from util_profile import profile_bam
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    bedfile = arguments['<bed_file>']
+    bamfile = arguments['<bam_file>']
+    WinSize = int(arguments['--window'])
+    genome_ver = arguments['--Ref_ver']
+    BinSize = int(arguments['--binsize'])
+    Nsite = int(arguments['--maxSite'])
+
+    FragSize = None
+    if ast.literal_eval(arguments['--fragment']) != None:
+        FragSize = int(arguments['--fragment'])
+
+    Sites = prepare_sites(bedfile, union=False, window=WinSize, genome=genome_ver)[:Nsite]
+    print("Number of sites: " + str(len(Sites)))
+    chroms, starts, ends = Sites.coords()
+
+    t0 = time.time()
+    native = profile_bam(bamfile, chroms, starts, ends, bins=BinSize, fragSize=FragSize)
+    t_native = time.time() - t0
+    print("util_profile: " + str(round(t_native, 2)) + " sec")
+
+    import metaseq
+    t0 = time.time()
+    intervals = pybedtools.BedTool.from_dataframe(Sites.to_dataframe()[['chrom', 'start', 'end']])
+    reference = metaseq.genomic_signal(bamfile, 'bam').array(intervals, bins=BinSize,
+            fragment_size=FragSize, processes=1)
+    t_metaseq = time.time() - t0
+    print("metaseq: " + str(round(t_metaseq, 2)) + " sec")
+
+    diff = np.abs(native - reference)
+    print("Speedup: " + str(round(t_metaseq / t_native, 1)) + "x")
+    print("Maximum absolute difference: " + str(diff.max()))
+    print("Mean absolute difference: " + str(diff.mean()))
+    print("Correlation: " + str(np.corrcoef(native.ravel(), reference.ravel())[0, 1]))
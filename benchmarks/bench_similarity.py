@@ -0,0 +1,98 @@
+"""Check the bitset engine for pairwise overlap and jaccard of bed files.
+
+Takes bed files, computes overlap and jaccard of all pairs with
+util_occupancy.pairwise_similarity, and compares them with the same
+measures of each pair computed alone (base pairs covered by both files,
+from the merged intervals of the two files), reporting run time of both.
+Before that, checks that a file bridging two others (A=chr1:0-10,
+B=chr1:18-30, C=chr1:8-20) does not make A and B overlap.
+
+Usage:
+   bench_similarity.py [options] <bedfiles>...
+
+Options:
+    --cores=<n_cores>   Number of processes used for the bitset engine [default: 1].
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from docopt import docopt
+import time
+import shutil
+import tempfile
+import numpy as np
+from util_occupancy import pairwise_similarity, read_beds, to_axis, merge_clusters
+
+
+# function for base pairs of merged intervals b (starts, ends) on the genome axis before each position x
+def covered_before(b, x):
+    starts, ends = b
+    cumulative = np.r_[0, np.cumsum(ends - starts)]
+    idx = np.searchsorted(starts, x, side='right')
+    last = np.maximum(idx - 1, 0)
+    partial = np.where(idx > 0, np.minimum(x, ends[last]) - starts[last], 0) if len(starts) > 0 else 0
+    return cumulative[last] + partial
+
+
+# function for base pairs covered by both of two sets of merged intervals on the genome axis
+def shared_bp(a, b):
+    return float((covered_before(b, a[1]) - covered_before(b, a[0])).sum())
+
+
+# function for overlap and jaccard of each pair of bed files computed alone
+def pairwise_reference(Bedfiles):
+    Nfiles = len(Bedfiles)
+    overlap = np.ones((Nfiles, Nfiles))
+    jaccard = np.ones((Nfiles, Nfiles))
+    chroms, starts, ends, fileid = read_beds(Bedfiles)
+    names, starts, ends = to_axis(chroms, starts, ends)
+    merged = [merge_clusters(starts[fileid == i], ends[fileid == i])[0] for i in range(Nfiles)]
+    sizes = [float((ends - starts).sum()) for starts, ends in merged]
+    for i in range(Nfiles):
+        for j in range(i+1, Nfiles):
+            shared = shared_bp(merged[i], merged[j])
+            overlap[i, j] = overlap[j, i] = shared / max(min(sizes[i], sizes[j]), 1)
+            jaccard[i, j] = jaccard[j, i] = shared / max(sizes[i] + sizes[j] - shared, 1)
+    return overlap, jaccard
+
+
+# function for checking that overlap of a pair does not depend on a third file bridging them
+def check_bridge():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        Bedfiles = []
+        for name, start, end in [('A', 0, 10), ('B', 18, 30), ('C', 8, 20)]:
+            Bedfiles.append(os.path.join(tmpdir, name + '.bed'))
+            with open(Bedfiles[-1], 'w') as f:
+                f.write('chr1\t' + str(start) + '\t' + str(end) + '\n')
+        three = pairwise_similarity(Bedfiles, 'overlap')
+        two = pairwise_similarity(Bedfiles[:2], 'overlap')
+    finally:
+        shutil.rmtree(tmpdir)
+    if three[0, 1] != 0 or two[0, 1] != 0:
+        raise AssertionError("A and B overlap through C: " + str(three[0, 1]) + " (" + str(two[0, 1]) + " alone)")
+    print("A and B do not overlap through C")
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    Bedfiles = arguments['<bedfiles>']
+    Cores = int(arguments['--cores'])
+
+    check_bridge()
+
+    t0 = time.time()
+    overlap = pairwise_similarity(Bedfiles, 'overlap', max_workers=Cores)
+    jaccard = pairwise_similarity(Bedfiles, 'jaccard', max_workers=Cores)
+    t_bitset = time.time() - t0
+    print("bitsets: " + str(round(t_bitset, 2)) + " sec")
+
+    t0 = time.time()
+    ref_overlap, ref_jaccard = pairwise_reference(Bedfiles)
+    t_pairs = time.time() - t0
+    print("pairs: " + str(round(t_pairs, 2)) + " sec")
+
+    print("Maximum absolute difference (overlap): " + str(np.abs(overlap - ref_overlap).max()))
+    print("Maximum absolute difference (jaccard): " + str(np.abs(jaccard - ref_jaccard).max()))
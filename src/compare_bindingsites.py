@@ -8,9 +8,10 @@ Usage:
 Options:
     --color=<col_scheme>    Color scheme for matplotlib. For more options, visit http://matplotlib.org/examples/color/colormaps_reference.html [default: Reds].
     --plottype=<plottype>  Type of visualization. Either one of heatmap, LTheatmap (lower-triangle heatmap), clustermap (heatmap with clustering) and matrix (save text file with similarity measured) [default: heatmap].
-    --measure=<sim_measure> Similarity measure. Can either be correlation (pearson correaltion in co-occupancy profile) or overlap (overlap rate in intervals) [default: correlation].
+    --measure=<sim_measure> Similarity measure. Can either be correlation (pearson correaltion in co-occupancy profile), overlap (base pairs covered by both files over base pairs covered by the smaller of the two files) or jaccard (base pairs covered by both files over base pairs covered by either file). overlap and jaccard of a pair of files do not depend on the other files given [default: correlation].
     --grad_max=<grad_max>   Upper bound of color gradient [default: 1.0].
     --grad_min=<grad_min>   Lower bound of color gradient [default: 0.0].
+    --cores=<n_cores>   Number of processes used for overlap and jaccard measures [default: 1].
 """
 
 from docopt import docopt
@@ -18,54 +19,21 @@ import matplotlib
 matplotlib.use('Agg')
 import ast
 import numpy as np
-import pybedtools as pb
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
+from util_occupancy import pairwise_similarity
 
-def create_array(Bedfiles, overlap=True):
-    mat = np.zeros((len(Bedfiles), len(Bedfiles)))
-    PyBedfiles = dict()
+def create_array(Bedfiles, measure='correlation', max_workers=1):
     colname = [None] * len(Bedfiles)
 
-    # create bedfiles
-    print("Collecting bemfiles... ")
     for i,Bedfile in zip(range(len(Bedfiles)),Bedfiles):
-        print("Obtaining " + Bedfile)
-        PyBedfiles[Bedfile] = pb.BedTool(Bedfile)
         colname[i] = (Bedfile.split('/')[-1]).split('.')[0]
 
-    # measure overlapping ratio
-    if overlap:
-        print("Calculate overlap ratio between bed files")
-        for i, Bedfile1 in zip(range(len(Bedfiles)),Bedfiles):
-            for j, Bedfile2 in zip(range(len(Bedfiles)),Bedfiles):
-                if i==j:
-                    mat[i,j]=1
-                elif j>i:
-                    mat[i,j] = len(PyBedfiles[Bedfile1].intersect(PyBedfiles[Bedfile2]))
-                    mat[i,j] = mat[i,j]/min(len(PyBedfiles[Bedfile1]), len(PyBedfiles[Bedfile2]))
-                    mat[j,i] = mat[i,j]
-
-    # measure similarity in co-occupancy profiles
-    else:
-        print("obtaining unions of bed files")
-        Union = pb.BedTool(Bedfile)
-        for Bedfile in Bedfiles:
-            Union = Union.cat(PyBedfiles[Bedfile])
-
-        print("Total " + str(len(Union)) + " sites were identified")
-        print("Identifing occupancy patterns of the files")
-
-        occupancy = np.zeros((len(Union), len(Bedfiles)))
-
-        for i, Bedfile in zip(range(len(Bedfiles)), Bedfiles):
-            tmp = Union.coverage(PyBedfiles[Bedfile], wo=True)
-            score = [int(site.name)!=0 for site in tmp]
-            occupancy[:,i] = np.array(score)
-
-        mat = np.corrcoef(occupancy.T)
-
+    # measure overlapping ratio (shared base pairs) or similarity in co-occupancy profiles
+    # over the union (clusters of overlapping intervals) of bed files
+    print("Calculate " + measure + " between bed files")
+    mat = pairwise_similarity(Bedfiles, measure=measure, max_workers=max_workers)
 
     return mat, colname
 
@@ -80,11 +48,12 @@ if __name__ == '__main__':
     vmax = float(arguments['--grad_max'])
     vmin = float(arguments['--grad_min'])
     measure = arguments['--measure']
+    N_cores = int(arguments['--cores'])
 
     if not PlotType in ['heatmap', 'LTheatmap', 'clustermap', 'matrix']:
         raise ValueError('Unknown plot type is given: ' + PlotType)
 
-    if not measure in ['correlation', 'overlap']:
+    if not measure in ['correlation', 'overlap', 'jaccard']:
         raise ValueError('Unknown similarity measure is given: ' + measure)
 
     print("Type of heatmap: " + PlotType)
@@ -92,7 +61,7 @@ if __name__ == '__main__':
     print("Color scheme: " + str(Cmap))
 
     # create co-occupancy map
-    mat, name = create_array(Bedfiles, overlap=measure == 'overlap')
+    mat, name = create_array(Bedfiles, measure=measure, max_workers=N_cores)
 
     # produce heatmap
     pdmat = pd.DataFrame(data=mat, columns=name)
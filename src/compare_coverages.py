@@ -19,77 +19,34 @@ import matplotlib
 matplotlib.use('Agg')
 import ast
 import numpy as np
-import pybedtools as pb
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-import concurrent.futures as cf
-
-def readcount(site, pathtobam, order):
-    read = pb.BedTool.coverage(site, pathtobam)
-    return order, read
-
-def flagstats(bamfile, order):
-    from subprocess import Popen, PIPE
-    p = Popen(['samtools', 'flagstat', bamfile], stdout=PIPE)
-    for line in p.stdout:
-        if "mapped" in line:
-            nmapped = line.rstrip().split()
-            nmapped = int(nmapped[0])
-            break
-    return nmapped, order
+from util_readcount import site_index, count_reads
+from util_libsize import library_sizes
+from util_normalize import normalize
+from util_sites import prepare_sites
 
 
 def create_array(Bedfiles, Bamfiles, max_workers=15):
-    mat = np.zeros((len(Bedfiles), len(Bedfiles)))
-    PyBedfiles = dict()
-    colname = [None] * len(Bedfiles)
-
-    # create bedfiles
-    print("Collecting bedfiles... ")
-    for i,Bedfile in zip(range(len(Bedfiles)),Bedfiles):
-        print("Obtaining " + Bedfile)
-        PyBedfiles[Bedfile] = pb.BedTool(Bedfile)
+    colname = [None] * len(Bamfiles)
 
     for i, Bamfile in enumerate(Bamfiles):
         colname[i] = (Bamfile.split('/')[-1]).split('.')[0]
 
-    print("Obtaining unions of binding sites")
-    UnionSite = PyBedfiles[Bedfile]
-    for Bedfile in PyBedfiles:
-        UnionSite = UnionSite.cat(PyBedfiles[Bedfile])
+    Sites = prepare_sites(Bedfiles, union=True)
 
     # reading bam reads
-    bamreads = [None]*len(Bamfiles)
-    futures = []
+    Index, lengths = site_index(*Sites.coords())
     print("Calculating read counts from bam files")
-    with cf.ThreadPoolExecutor(max_workers=max_workers) as e:
-        for order in range(len(Bamfiles)):
-            futures.append(e.submit(readcount, UnionSite, Bamfiles[order], order))
-
-        for future in cf.as_completed(futures):
-            order, read = future.result()
-            bamreads[order] = read
+    reads = count_reads(Index, len(lengths), Bamfiles, max_workers=max_workers)
 
     # measuring total number of reads
     print("Calculating FPKM")
-    Nreads = [None] * len(Bamfiles)
-    futures = []
-    with cf.ThreadPoolExecutor(max_workers=max_workers) as e:
-        for order in range(len(Bamfiles)):
-            futures.append(e.submit(flagstats, Bamfiles[order], order))
-
-        for future in cf.as_completed(futures):
-            read, order = future.result()
-            Nreads[order] = float(read)
-
-
-    counts = np.zeros((len(UnionSite), len(Bamfiles)))
-    for i in range(len(Bamfiles)):
-        for j, site in enumerate(bamreads[i]):
-            counts[j,i] = int(site.name)*(1000000000/Nreads[i])/float(site.length)
+    Nreads = library_sizes(Bamfiles, max_workers=max_workers)
 
-    mat = np.corrcoef(np.log2(counts.T+1))
+    counts = normalize(reads, lengths, Nreads, measure='FPKM', base=2)
+    mat = np.corrcoef(counts.T)
 
 
     return mat, colname
@@ -7,31 +7,60 @@ Usage:
 
 Options:
     --thrs=<thrs>    An integer for threshold of frequency for consensus sites. If not specified, half of the number of bed files is used [default: Half].
+    --mode=<mode>    Type of consensus sites. union (clusters of overlapping sites supported by more than thrs sites), depth (regions where more than thrs sites overlap, with the maximum depth) or summit (window of --width around the position of maximum depth in each union consensus site) [default: union].
+    --width=<width>  Width of consensus sites in summit mode [default: 200].
 """
 
 from docopt import docopt
 import ast
 import numpy as np
-import pybedtools as pb
+import pandas as pd
+from util_occupancy import read_beds, to_axis, from_axis, merge_clusters, depth_segments
 
 
-def create_consensus(Bedfiles, thr):
-    pyBedfiles = dict()
-    for i,Bedfile in zip(range(len(Bedfiles)), Bedfiles):
+def create_consensus(Bedfiles, thr, mode='union', width=200):
+    for Bedfile in Bedfiles:
         print("Obtaining " + Bedfile)
-        pyBedfiles[Bedfile] = pb.BedTool(Bedfile)
+    chroms, starts, ends, fileid = read_beds(Bedfiles)
+    names, starts, ends = to_axis(chroms, starts, ends)
 
-    Union = pyBedfiles[Bedfile]
-    for Bedfile in Bedfiles:
-        Union = Union.cat(pyBedfiles[Bedfile])
+    # number of sites in each cluster of overlapping sites (union)
+    (Unionstart, Unionend), cluster = merge_clusters(starts, ends)
+    Counts = np.bincount(cluster, minlength=len(Unionstart))
 
-    Counts=np.zeros((len(Union),))
-    for Bedfile in Bedfiles:
-        intersect = Union.intersect(pyBedfiles[Bedfile], c=True)
-        Counts = Counts + np.array([int(interval[3]) for interval in intersect])
+    if mode == 'union':
+        keep = Counts > thr
+        chrom, start, end = from_axis(names, Unionstart[keep], Unionend[keep])
+        return pd.DataFrame({'chrom': chrom, 'start': start, 'end': end},
+                columns=['chrom', 'start', 'end'])
+
+    segstart, segend, depth = depth_segments(starts, ends)
 
-    Consensus = Union.at(np.where(Counts>thr)[0])
-    return Consensus
+    if mode == 'depth':
+        sel = depth > thr
+        segstart, segend, depth = segstart[sel], segend[sel], depth[sel]
+        if not sel.any():
+            return pd.DataFrame(columns=['chrom', 'start', 'end', 'depth'])
+        first = np.where(np.r_[True, segstart[1:] != segend[:-1]])[0]
+        last = np.r_[first[1:], len(segstart)] - 1
+        chrom, start, end = from_axis(names, segstart[first], segend[last])
+        maxdepth = np.maximum.reduceat(depth, first)
+        return pd.DataFrame({'chrom': chrom, 'start': start, 'end': end, 'depth': maxdepth},
+                columns=['chrom', 'start', 'end', 'depth'])
+
+    # summit: segment with maximum depth (first one if tied) in each consensus cluster
+    segcluster = np.searchsorted(Unionstart, segstart, side='right') - 1
+    order = np.lexsort((segstart, -depth, segcluster))
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = segcluster[order][1:] != segcluster[order][:-1]
+    first = order[new]
+    first = first[Counts[segcluster[first]] > thr]
+    summit = (segstart[first] + segend[first]) // 2
+    chrom, start, end = from_axis(names, summit, summit)
+    start = np.maximum(start - width // 2, 0)
+    end = end + (width - width // 2)
+    return pd.DataFrame({'chrom': chrom, 'start': start, 'end': end, 'depth': depth[first]},
+            columns=['chrom', 'start', 'end', 'depth'])
 
 
 if __name__ == '__main__':
@@ -40,6 +69,11 @@ if __name__ == '__main__':
     Bedfiles = arguments['<bedfiles>']
     Outfile = arguments['<outfile>']
     thrs = arguments['--thrs']
+    mode = arguments['--mode']
+    width = int(arguments['--width'])
+
+    if not mode in ['union', 'depth', 'summit']:
+        raise ValueError('Unknown type of consensus sites is given: ' + mode)
 
     if thrs == "Half":
         thrs = np.floor(len(Bedfiles)/2)
@@ -50,7 +84,6 @@ if __name__ == '__main__':
             print("Should give numeric values for threshold.")
             raise
 
-    Consensus = create_consensus(Bedfiles, thrs)
+    Consensus = create_consensus(Bedfiles, thrs, mode=mode, width=width)
     print("Saving output at " + Outfile)
-    Consensus.saveas(Outfile)
-
+    Consensus.to_csv(Outfile, sep='\t', header=False, index=False)
@@ -6,103 +6,56 @@ Usage:
     construct_coverage_matrix.py [options] <outfile> <bedfiles> <bamfiles>...
 
 Options:
-    --measure=<measure>   Either Raw, FPKM or CPM used to calculate coverage. [default: FPKM].
+    --measure=<measure>   Either Raw, FPKM, CPM, TPM or SizeFactor used to calculate coverage (log2-transformed except Raw). [default: FPKM].
     --cores=<cores>  Maximum number of jobs to be excuted in parallel. [default: 10].
-    --sorted=<sorted>   To run memory-efficient coverage calculation. Pre-sorted bams are required [default: False].
+    --sorted=<sorted>   Sort sites in the order of chromosomes in the bam header [default: False].
+    --count_method=<method>   Either fetch (indexed region fetch per site) or sweep (one fetch per block of overlapping sites) [default: fetch].
+    --format=<format>   Either tsv, npy (directory with memory-mappable matrix.npy, sites and sample names) or parquet [default: tsv].
 """
 
 from docopt import docopt
 import ast
-import numpy as np
-import pybedtools as pb
-import pandas as pd
-import concurrent.futures as cf
-import os
-from tempfile import NamedTemporaryFile as temp
-
-def readcount(site, pathtobam, order, sorted):
-    read = pb.BedTool.coverage(site, pathtobam, counts=True, sorted=sorted)
-    return order, read
-
-def flagstats(bamfile, order):
-    from subprocess import Popen, PIPE
-    p = Popen(['samtools', 'flagstat', bamfile], stdout=PIPE)
-    for line in p.stdout:
-        if "mapped" in line:
-            nmapped = line.rstrip().split()
-            nmapped = int(nmapped[0])
-            break
-    return nmapped, order
-
-
-def create_array(Bedfiles, Bamfiles, measure='FPKM', max_workers=15, sorted=False):
-    mat = np.zeros((len(Bedfiles), len(Bedfiles)))
-    PyBedfiles = dict()
-
-    # create bedfiles
-    print("Collecting bedfiles... ")
-    for i,Bedfile in zip(range(len(Bedfiles)),Bedfiles):
-        print("Obtaining " + Bedfile)
-        PyBedfiles[Bedfile] = pb.BedTool(Bedfile)
-
-    if len(Bedfiles) > 1:
-        print("Obtaining unions of binding sites")
-        UnionSite = PyBedfiles[Bedfile]
-        for Bedfile in PyBedfiles:
-            UnionSite = UnionSite.cat(PyBedfiles[Bedfile])
-    else:
-        UnionSite = PyBedfiles[Bedfiles[0]]
-
-
+from util_readcount import site_index, count_reads
+from util_libsize import library_sizes
+from util_normalize import normalize, MEASURES
+from util_sites import prepare_sites, bam_chroms
+from util_bed import SiteTable
+from util_matrix import write_matrix, FORMATS
+
+
+# Sites: SiteTable, or bed files of which union is taken if multiple bed files are given
+# returns (SiteTable, site x bam matrix)
+def create_array(Sites, Bamfiles, measure='FPKM', max_workers=15, sorted=False, method='fetch'):
+    chrom_order = None
     if sorted:
         print("Sorted bam/bed files are given. Extracting chromosome names")
-        #tmpfile = UnionSite._tmp()
-        #os.system('sort {0} -k1,1 -k2,2n > {1}'.format(UnionSite.fn, tmpfile))
-        with temp('w') as f:
-            command = """samtools view -H """ + Bamfiles[0] + """ | grep SQ | cut -f 2,3 | awk '{sub(/^SN:/,""); sub(/LN:/,""); print;}' >  """ + f.name
-            os.system(command)
-            UnionSite = UnionSite.sort(faidx=f.name)
-        #UnionSite = pb.BedTool(tmpfile)
+        chrom_order = bam_chroms(Bamfiles[0])
+
+    if isinstance(Sites, SiteTable):
+        if chrom_order is not None:
+            Sites = Sites.sort(chrom_order)
+    else:
+        # union of sites if multiple bed files are given, otherwise sites of the bed file as-is
+        Sites = prepare_sites(Sites, union=len(Sites) > 1, chrom_order=chrom_order)
 
     # reading bam reads
-    bamreads = [None]*len(Bamfiles)
-    futures = []
+    print("Indexing sites")
+    Index, lengths = site_index(*Sites.coords())
     print("Calculating read counts from bam files")
-    with cf.ThreadPoolExecutor(max_workers=max_workers) as e:
-        for order in range(len(Bamfiles)):
-            futures.append(e.submit(readcount, UnionSite, Bamfiles[order], order, sorted))
-
-        for future in cf.as_completed(futures):
-            order, read = future.result()
-            bamreads[order] = read
+    reads = count_reads(Index, len(lengths), Bamfiles, max_workers=max_workers, method=method)
 
     # measuring total number of reads
     if measure in ['FPKM', 'CPM']:
         print('Obtaining library depth..')
-        Nreads = [None] * len(Bamfiles)
-        futures = []
-        with cf.ThreadPoolExecutor(max_workers=max_workers) as e:
-            for order in range(len(Bamfiles)):
-                futures.append(e.submit(flagstats, Bamfiles[order], order))
-
-            for future in cf.as_completed(futures):
-                read, order = future.result()
-                Nreads[order] = float(read)
+        Nreads = library_sizes(Bamfiles, max_workers=max_workers)
+    else:
+        Nreads = None
 
     print("Calculating " + measure)
-    counts = np.zeros((len(UnionSite), len(Bamfiles)))
-    for i in range(len(Bamfiles)):
-        for j, site in enumerate(bamreads[i]):
-            if measure == 'FPKM':
-                counts[j,i] = np.log2(float(site[-1])*(1000000000/Nreads[i])/float(site.length)+1)
-            elif measure == 'CPM':
-                counts[j,i] = np.log2(float(site[-1])*(1000000000/Nreads[i])+1)
-            else:
-                counts[j,i] = int(site[-1])
-
-    df =  pd.concat([UnionSite.to_dataframe(), pd.DataFrame(counts, columns=Bamfiles)], axis=1)
+    counts = normalize(reads, lengths, Nreads, measure=measure,
+            base=None if measure == 'Raw' else 2)
 
-    return df
+    return Sites, counts
 
 
 if __name__ == '__main__':
@@ -115,11 +68,16 @@ if __name__ == '__main__':
 
     Measure = str(arguments['--measure'])
     Cores = int(arguments['--cores'])
+    Method = str(arguments['--count_method'])
+    Format = str(arguments['--format'])
 
-    if not Measure in ['FPKM', 'CPM', 'Raw']:
-        raise ValueError("Unknown measure: " + Measure + " , should be either of FPKM and CPM")
+    if not Measure in MEASURES:
+        raise ValueError("Unknown measure: " + Measure + " , should be either of " + ', '.join(MEASURES))
+    if not Format in FORMATS:
+        raise ValueError("Unknown format: " + Format + " , should be either of " + ', '.join(FORMATS))
 
-    df = create_array(Bedfiles, Bamfiles, measure=Measure, max_workers=Cores, sorted=sorted==True)
-    df.to_csv(Outfile, sep='\t', header=True, index=False)
+    Sites, counts = create_array(Bedfiles, Bamfiles, measure=Measure, max_workers=Cores, sorted=sorted==True, method=Method)
+    print("Saving outcome at " + Outfile)
+    write_matrix(Outfile, Sites, counts, Bamfiles, format=Format)
 
 
@@ -6,28 +6,27 @@ Usage:
     construct_occupancy_matrix.py [options] <outfile> <refbed> <otherbed>...
 
 Options:
+    --mode=<mode>   Occupancy measure. Either Binary (overlapped or not), Count (number of overlapping intervals) or Overlap (overlapping base pairs) [default: Binary].
+    --format=<format>   Either tsv, npy (directory with memory-mappable matrix.npy, sites and sample names) or parquet [default: tsv].
 """
 
 from docopt import docopt
-import pybedtools as pb
-import pandas as pd
-import numpy as np
+from util_bed import SiteTable
+from util_occupancy import occupancy_matrix, MODES
+from util_matrix import write_matrix, FORMATS
 
 
-def co_occupancy(Refbed, Bedfiles):
-   Reference = pb.BedTool(Refbed)
+# Reference: SiteTable or reference bed file, returns (SiteTable, site x bed file matrix)
+def co_occupancy(Reference, Bedfiles, mode='Binary'):
+   if isinstance(Reference, SiteTable):
+       print("Total " + str(len(Reference)) + " sites in the reference")
+   else:
+       Refbed = Reference
+       Reference = SiteTable.from_bed(Refbed)
+       print("Total " + str(len(Reference)) + " sites in the reference bed: " + Refbed)
 
-   print("Total " + str(len(Reference)) + " sites in the reference bed: " + Refbed)
-
-   occupancy = np.zeros((len(Reference), len(Bedfiles)))
-   for bed,i in zip(Bedfiles, range(len(Bedfiles))):
-       print("Checking occupancy of " + bed + " in Reference bed")
-       tmp = Reference.coverage(pb.BedTool(bed), wo=True)
-       score = [int(site.name)!=0 for site in tmp]
-       occupancy[:, i] = np.array(score)
-
-   df = pd.concat([Reference.to_dataframe(), pd.DataFrame(occupancy, columns=Bedfiles)], axis=1)
-   return df
+   occupancy = occupancy_matrix(*Reference.coords(), Bedfiles=Bedfiles, mode=mode)
+   return Reference, occupancy
 
 
 if __name__ == '__main__':
@@ -36,8 +35,15 @@ if __name__ == '__main__':
     Refbed = arguments['<refbed>']
     Outmat = arguments['<outfile>']
     Bedfiles = arguments['<otherbed>']
+    Mode = str(arguments['--mode'])
+    Format = str(arguments['--format'])
+
+    if not Mode in MODES:
+        raise ValueError("Unknown mode: " + Mode + " , should be either of " + ', '.join(MODES))
+    if not Format in FORMATS:
+        raise ValueError("Unknown format: " + Format + " , should be either of " + ', '.join(FORMATS))
 
-    df = co_occupancy(Refbed, Bedfiles)
+    Reference, occupancy = co_occupancy(Refbed, Bedfiles, mode=Mode)
 
     print("Saving outcome at " + Outmat)
-    df.to_csv(Outmat, sep='\t', header=True, index=False)
+    write_matrix(Outmat, Reference, occupancy, Bedfiles, format=Format)
@@ -15,63 +15,97 @@ Options:
     --prefix_bam=<prefix>   Common prefix for bam_file to locate them [default: None].
     --suffix_bam=<suffix>   Common suffix for bam_file to locate them [default: None].
     --window=<window-size>  Size of genomic locations [default: 1000].
-    --threads=<thred-num>   Number of threads for calculating coverage [default: 1].
-    --Ref_ver=<ref_ver>     Reference genome version [default: hg19].
-    --fragment=<frag-size>  Size of fragment size by which each read is extended toward 3'end (used in metaseq function) [default: None].
+    --threads=<thred-num>   Number of processes for calculating coverage [default: 1].
+    --site_chunks=<n-chunks>   Number of chunks into which sites are split for each bam, so that a bam can be processed by multiple processes [default: 1].
+    --Ref_ver=<ref_ver>     Reference genome version, or a file with chromosome sizes [default: hg19].
+    --fragment=<frag-size>  Size of fragment size by which each read is extended toward 3'end [default: None].
     --binsize=<bin-size>    Number of bins to which coverages in each genomic coordiates are summurized. If None is given, number of bins is the same as window size [default: None].
+    --dtype=<dtype>     Data type of the coverage stored in the output, e.g. float32, float64 or uint16 (rounded) [default: float32].
+    --chunk_sites=<chunk-sites>    Number of sites in a compressed chunk of the output. Coverage is computed and written in blocks of at most this many sites [default: 1000].
 """
 
 from docopt import docopt
-import pybedtools
-import xarray as xr
 import ast
 import pandas as pd
+import numpy as np
+from util_netcdf import create_coverage, write_block
+from util_sites import prepare_sites
 
-# function for obtaining center of genomic locations
-def midpoint_generator(bedfile):
-    from pybedtools.featurefuncs import midpoint
-    for interval in bedfile:
-        yield midpoint(interval)
 
+# number of positions in profiles: bins if given, otherwise the longest site
+def position_size(starts, ends, bins=None):
+    if bins is None:
+        return int((ends - starts).max())
+    return bins
 
-# function for calculating coverage
-def coverage(Bedfile, Bamfiles, Nproc, bins=None, fragSize=None):
-    import metaseq
-    import numpy as np
 
-    ip_array = []
-    for Bamfile in Bamfiles:
-        print("Calculating coverages from : " + Bamfile)
-        ip_signal = metaseq.genomic_signal(Bamfile, 'bam')
-        ip_array.append(ip_signal.array(Bedfile, bins=bins, fragment_size=fragSize, processes=Nproc))
+# function for calculating coverage of a chunk of sites in a bam (or bigwig) file
+# the result is written to the shared (Sample, Coordinate, Position) array,
+# or returned if no shared array is given
+def coverage_unit(File, order, chroms, starts, ends, lo, shm_name, shape, bins=None, fragSize=None, isbigwig=False):
+    from util_parallel import attach_shared
+    from util_profile import profile_bam, profile_bigwig
 
-    return np.asarray(ip_array)
+    if shm_name is None:
+        shm, out = None, None
+    else:
+        shm, array = attach_shared(shm_name, shape)
+        out = array[order, lo:lo+len(starts), :]
 
-# function for calculating 
-def coverage_bw(Bedfile, BigWigs, bins=None):
-    import subprocess as sp
-    import numpy as np
-    Bedfile.saveas('tmp_bed.bed')
+    if isbigwig:
+        out = profile_bigwig(File, chroms, starts, ends, bins=bins, out=out)
+    else:
+        out = profile_bam(File, chroms, starts, ends, bins=bins, fragSize=fragSize, out=out)
 
-    ip_array = []
-    for BigWig in BigWigs:
-        print("Calculating coverages from : " + BigWig)
-        command = ['bwtool', 'extract', 'bed', 'tmp_bed.bed', BigWig, 'tmp.bed']
-        print(' '.join(command))
-        p = sp.Popen(command, stdout=sp.PIPE, stdin=sp.PIPE)
-        p.wait()
+    if shm is None:
+        return order, lo, out
+    shm.close()
+    return order, lo, None
 
-        out = pybedtools.BedTool('tmp.bed')
 
-        if bins == None:
-            mat = np.vstack(
-                    [np.array(str(a[-1]).split(',')) for a in out]
-                    )
-            mat[mat=='NA'] = '0'
-            mat.astype(float)
-            ip_array.append(mat)
+# function for calculating coverage of sites (SiteTable)
+# (bam, chunk of sites) units are run over Nproc processes, sites of each bam are split into Nchunks
+# if writer is given, each block is passed to writer(order, lo, block) as soon as it is computed
+# instead of being collected into the returned array, chunks are then aligned to chunk_sites
+def coverage(Sites, Bamfiles, Nproc, bins=None, fragSize=None, Nchunks=1, isbigwig=False, writer=None, chunk_sites=None):
+    import numpy as np
+    from util_parallel import create_shared, site_chunks, run_units
+    from util_readcount import index_bams
+
+    chroms, starts, ends = Sites.coords()
+    shape = (len(Bamfiles), len(starts), position_size(starts, ends, bins))
+    if not isbigwig:
+        index_bams(Bamfiles)
 
-    return np.asarray(ip_array)
+    if writer is None:
+        shm, ip_array = create_shared(shape)
+        shm_name = shm.name
+    else:
+        shm, ip_array, shm_name = None, None, None
+
+    units = ((Bamfile, order, chroms[lo:hi], starts[lo:hi], ends[lo:hi],
+                lo, shm_name, shape, bins, fragSize, isbigwig)
+            for order, Bamfile in enumerate(Bamfiles)
+            for lo, hi in site_chunks(len(starts), Nchunks, align=chunk_sites))
+
+    try:
+        for order, lo, block in run_units(coverage_unit, units, max_workers=Nproc):
+            print("Calculated coverages from : " + Bamfiles[order] + " (sites from " + str(lo) + ")")
+            if writer is not None:
+                writer(order, lo, block)
+        if shm is not None:
+            ip_array = np.array(ip_array)
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    return ip_array
+
+# function for calculating coverage from bigwig files
+def coverage_bw(Sites, BigWigs, bins=None, Nproc=1, Nchunks=1, writer=None, chunk_sites=None):
+    return coverage(Sites, BigWigs, Nproc, bins=bins, Nchunks=Nchunks, isbigwig=True,
+            writer=writer, chunk_sites=chunk_sites)
 
 # main 
 if __name__ == '__main__':
@@ -81,6 +115,7 @@ if __name__ == '__main__':
     bamfiles = arguments['<bam_file>']
     WinSize = int(arguments['--window'])
     Nthread = int(arguments['--threads'])
+    Nchunks = int(arguments['--site_chunks'])
     genome_ver = arguments['--Ref_ver']
     IsBigWig = arguments['--isbigwig'] in ['True', 'true']
     Istable = arguments['--isTable'] in ['True', 'true']
@@ -96,7 +131,8 @@ if __name__ == '__main__':
     print("Reading coverage of coordinates specified by: " + bedfile)
     print("With +/- " + str(WinSize) + "bp of window size")
     print("Reference genome :" + genome_ver)
-    print("Number of threads: " + str(Nthread))
+    print("Number of processes: " + str(Nthread))
+    print("Number of site chunks per bam: " + str(Nchunks))
 
     if Istable:
         tableName = bamfiles[0]
@@ -123,22 +159,28 @@ if __name__ == '__main__':
 
 
     #identify sites
-    Sites = pybedtools.BedTool(bedfile)
-    MidSites = pybedtools.BedTool(midpoint_generator(Sites))
-    Sites = MidSites.slop(b=WinSize, genome=genome_ver)
-
-    #calculate covrage
-    if not IsBigWig:
-        array = coverage(Sites, Bamfiles=bamfiles, Nproc=Nthread, bins=BinSize, fragSize=FragSize)
-    else:
-        array = coverage_bw(Sites, bamfiles, BinSize)
-    print("Calculating coverage was completed")
-
-    #save output
-    Out = xr.Dataset({'Coverage': xr.DataArray(array, dims = ['Sample', 'Coordinate', 'Position'],
-        coords = {'Sample':bamfiles})})
+    Sites = prepare_sites(bedfile, union=False, window=WinSize, genome=genome_ver)
 
+    #prepare output
     Outfile = arguments['<netcdf_out>']
-    print('Saving output to :' + Outfile)
-    Out.to_netcdf(str(Outfile))
+    OutType = str(arguments['--dtype'])
+    ChunkSites = int(arguments['--chunk_sites'])
+    Nchunks = max(Nchunks, int(np.ceil(len(Sites) / float(ChunkSites))))
+    print('Saving output to :' + Outfile + ' (' + OutType + ')')
+    Out = create_coverage(Outfile, bamfiles, len(Sites), position_size(Sites.starts, Sites.ends, BinSize),
+            dtype=OutType, chunk_sites=ChunkSites)
 
+    def writer(order, lo, block):
+        write_block(Out, order, lo, block)
+
+    #calculate covrage
+    try:
+        if not IsBigWig:
+            coverage(Sites, Bamfiles=bamfiles, Nproc=Nthread, bins=BinSize, fragSize=FragSize, Nchunks=Nchunks,
+                    writer=writer, chunk_sites=ChunkSites)
+        else:
+            coverage_bw(Sites, bamfiles, BinSize, Nproc=Nthread, Nchunks=Nchunks,
+                    writer=writer, chunk_sites=ChunkSites)
+    finally:
+        Out.close()
+    print("Calculating coverage was completed")
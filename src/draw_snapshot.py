@@ -12,42 +12,58 @@ Options:
     --green=<green>  green of RGB color code [default: 0].
     --blue=<blue>  blue of RGB color code [default: 0].
     --maxSite=<maxsite>  number of sites to be used [default: 5].
+    --cores=<cores>  number of bam files read in parallel [default: 1].
 """
 
 from docopt import docopt
-import pybedtools
 import matplotlib
 
-def draw_snapshot(sites, bamfiles, color="black", min_y=30, Nsite=5):
-    import metaseq
-    import matplotlib.pyplot as plt
-    from mpl_toolkits.axes_grid1 import Grid
 
+# function for extracting tracks of a bam file at sites, in one sorted pass over the bam file
+# each site is reduced to bins values (maximum coverage in each bin)
+def snapshot_unit(bamfile, order, chroms, starts, ends, bins):
+    from util_profile import profile_bam
+    return order, profile_bam(bamfile, chroms, starts, ends, bins=bins, stat='max')
 
-    Nsites_use = min(Nsite, len(sites))
 
-    # take read counts from samples
-    ip_signals = [None]*len(bamfiles)
-    ip_arrays = [None]*len(bamfiles)
-    for i, bamfile in zip(range(len(bamfiles)), bamfiles):
-        ip_signals[i] = metaseq.genomic_signal(bamfile, 'bam')
-        ip_arrays[i] = [None]*Nsites_use
-        for k in range(Nsites_use):
-            ip_arrays[i][k] = ip_signals[i].local_coverage(sites[k])
+def draw_snapshot(sites, bamfiles, color="black", min_y=30, Nsite=5, dpi=100, max_workers=1):
+    import numpy as np
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.axes_grid1 import Grid
+    from util_parallel import run_units
+
+    chroms, starts, ends = [np.asarray(x)[:Nsite] for x in sites]
+    Nsites_use = len(starts)
 
     # draw figure
-    fig = plt.figure(figsize=(100, 20))
+    fig = plt.figure(figsize=(100, 20), dpi=dpi)
 
     grid = Grid(fig, 142, nrows_ncols=(len(bamfiles), Nsites_use),
             axes_pad=0.05, direction="row",
             add_all=True, share_all=False, label_mode="all")
 
-    ymaxs = [None]*len(bamfiles)
+    # take read counts from samples, downsampled to the pixel width of panels
+    pixels = int(np.ceil(grid[0].get_position().width * fig.get_figwidth() * dpi))
+    bins = max(1, min(pixels, int((ends - starts).max())))
+    units = [(bamfile, i, chroms, starts, ends, bins) for i, bamfile in enumerate(bamfiles)]
+    ip_arrays = [None]*len(bamfiles)
+    if max_workers > 1:
+        for i, profile in run_units(snapshot_unit, units, max_workers=max_workers):
+            ip_arrays[i] = profile
+    else:
+        for unit in units:
+            i, profile = snapshot_unit(*unit)
+            ip_arrays[i] = profile
+
+    ymaxs = [0]*len(bamfiles)
 
     for i in range(len(bamfiles)):
         for k in range(Nsites_use):
-            grid[i*Nsites_use+k].bar(ip_arrays[i][k][0],
-                    ip_arrays[i][k][1], color=color, edgecolor=color)
+            # filled step polygon over bin edges
+            edges = np.linspace(starts[k], ends[k], bins+1)
+            profile = ip_arrays[i][k]
+            grid[i*Nsites_use+k].fill_between(edges, np.r_[profile, profile[-1]], step='post',
+                    color=color, linewidth=0)
             xmin, xmax, ymin, ymax = grid[i*Nsites_use+k].axis()
             ymaxs[i] = max(ymaxs[i], ymax)
 
@@ -55,7 +71,7 @@ def draw_snapshot(sites, bamfiles, color="black", min_y=30, Nsite=5):
     for i in range(len(bamfiles)):
         for k in range(Nsites_use):
             xmin, xmax, ymin, ymax = grid[i*Nsites_use+k].axis()
-            grid[i*Nsites_use+k].axis([xmin,xmax,ymin, ymaxs[i]])
+            grid[i*Nsites_use+k].axis([starts[k], ends[k], ymin, ymaxs[i]])
             grid[i*Nsites_use+k].get_xaxis().set_visible(False)
             grid[i*Nsites_use+k].get_yaxis().set_visible(False)
             grid[i*Nsites_use+k].annotate(
@@ -66,11 +82,8 @@ def draw_snapshot(sites, bamfiles, color="black", min_y=30, Nsite=5):
                     textcoords='offset points',
                     fontsize=25)
             if i==0:
-                chrom = str(sites[k]).split('\t')[0]
-                start = str(sites[k]).split('\t')[1]
-                end = str(sites[k]).split('\t')[2].split('\n')[0]
                 grid[i*Nsites_use+k].set_title(
-                        "Location: " + chrom + " " + start + "-" + end
+                        "Location: " + str(chroms[k]) + " " + str(starts[k]) + "-" + str(ends[k])
                         )
 
     return fig
@@ -87,15 +100,17 @@ if __name__ == '__main__':
     green = float(arguments['--green'])
     blue = float(arguments['--blue'])
     Nsite = int(arguments['--maxSite'])
+    Nproc = int(arguments['--cores'])
 
     #printing information
     print("Reading coverage of coordinates specified by: " + bedfile)
 
 
     matplotlib.use('Agg')
+    from util_bed import read_bed
 
-    sites=pybedtools.BedTool(bedfile)
-    fig = draw_snapshot(sites, bamfiles, color=(red, green, blue),
-            min_y=30, Nsite=Nsite)
+    # top sites are loaded once
+    Sites = read_bed(bedfile, coords_only=True, nrows=Nsite)
+    fig = draw_snapshot((Sites.chrom.values, Sites.start.values, Sites.end.values), bamfiles,
+            color=(red, green, blue), min_y=30, Nsite=Nsite, dpi=100, max_workers=Nproc)
     fig.savefig(outfile, dpi=100, bbox_inches="tight")
-
@@ -16,12 +16,15 @@ Options:
     --x_range=<x_range>   Actual range in base pairs from center of the ragion [default: 5000].
     --x_lim=<x_lim>   Axis limit for x axis [default: 2500].
     --y_lim=<y_lim>    Axis limit for y axis [default: 50].
+    --ci_method=<ci_method>   Confidence interval from bootstrap of the mean or standard error (normal approximation). Either bootstrap or se [default: bootstrap].
+    --chunk_sites=<chunk_sites>    Number of regions read from the file at once [default: 10000].
+    --table_out=<table_out>   Save aggregate profiles (mean, standard error and confidence interval per sample and position) in a tab-delimited file [default: None].
 """
 
 from docopt import docopt
 import matplotlib
 matplotlib.use('Agg')
-import xarray as xa
+from util_netcdf import open_coverage
 import ast
 import seaborn as sns
 sns.set(style="white")
@@ -29,26 +32,88 @@ import pandas as pd
 import numpy as np
 
 
-def expected_average(array, names, color, xlim, ylim, x_range, c_interval):
+# function for calculating per-sample mean, standard error and confidence band over regions
+# each sample is read once, chunk by chunk. Confidence bands are obtained either by
+# poisson bootstrap of the mean (accumulated in the same pass) or from the standard error
+def profile_statistics(array, c_interval=75, ci_method='bootstrap', n_boot=200, chunk_sites=10000, seed=0):
+    from scipy.stats import norm
+
+    Nsample, Ncoord, Npos = array.shape
+    rng = np.random.RandomState(seed)
+    means = np.zeros((Nsample, Npos))
+    ses = np.zeros((Nsample, Npos))
+    lower = np.zeros((Nsample, Npos))
+    upper = np.zeros((Nsample, Npos))
+
+    for i in range(Nsample):
+        total = np.zeros(Npos)
+        sumsq = np.zeros(Npos)
+        boot = np.zeros((n_boot, Npos))
+        weight = np.zeros(n_boot)
+        for lo in range(0, Ncoord, chunk_sites):
+            block = np.asarray(array[i, lo:lo+chunk_sites, :], dtype=np.float64)
+            total += block.sum(axis=0)
+            sumsq += np.square(block).sum(axis=0)
+            if ci_method == 'bootstrap':
+                W = rng.poisson(1.0, (n_boot, block.shape[0]))
+                boot += W.dot(block)
+                weight += W.sum(axis=1)
+
+        means[i, :] = total / Ncoord
+        var = (sumsq - Ncoord * np.square(means[i, :])) / max(Ncoord - 1, 1)
+        ses[i, :] = np.sqrt(np.maximum(var, 0) / Ncoord)
+
+        if ci_method == 'bootstrap':
+            bootmeans = boot / np.maximum(weight, 1)[:, np.newaxis]
+            lower[i, :], upper[i, :] = np.percentile(bootmeans,
+                    [50 - c_interval / 2.0, 50 + c_interval / 2.0], axis=0)
+        else:
+            z = norm.ppf(0.5 + c_interval / 200.0)
+            lower[i, :] = means[i, :] - z * ses[i, :]
+            upper[i, :] = means[i, :] + z * ses[i, :]
+
+    return means, ses, lower, upper
+
+
+# function for building aggregate profile table (Sample, Position, Mean, SE, Lower, Upper)
+def profile_table(names, positions, means, ses, lower, upper):
+    Npos = len(positions)
+    return pd.DataFrame({
+        'Sample': np.repeat(np.asarray(names), Npos),
+        'Position': np.tile(positions, len(names)),
+        'Mean': means.ravel(),
+        'SE': ses.ravel(),
+        'Lower': lower.ravel(),
+        'Upper': upper.ravel()},
+        columns=['Sample', 'Position', 'Mean', 'SE', 'Lower', 'Upper'])
+
+
+def expected_average(array, names, color, xlim, ylim, x_range, c_interval, ci_method='bootstrap', chunk_sites=10000, table_out=None):
     import matplotlib.pyplot as plt
     plt.rcParams['font.family'] = 'Arial'
     plt.rcParams['font.size'] = 20
     plt.rcParams['ytick.labelsize']='large'
     plt.rcParams['xtick.labelsize']='large'
 
+    means, ses, lower, upper = profile_statistics(array, c_interval=c_interval,
+            ci_method=ci_method, chunk_sites=chunk_sites)
+    positions = np.linspace(-x_range,x_range,array.shape[2])
 
-    means = np.zeros((len(names), array.shape[2]))
-    for i in range(len(names)):
-        means[i,:] = array[i,:,:].mean(axis=0)
+    if table_out is not None:
+        print("Saving aggregate profiles at " + table_out)
+        profile_table(names, positions, means, ses, lower, upper).to_csv(table_out, sep='\t', index=False)
 
-    Table = pd.DataFrame(means,
-        index = names, columns = np.linspace(-x_range,x_range,array.shape[2]))
-
-    Table = pd.concat([pd.DataFrame({"Sample": names}, index = names), Table], axis=1)
+    if isinstance(color, str):
+        colors = sns.color_palette(color, len(names))
+    else:
+        colors = [color] * len(names)
 
     fig = plt.figure(figsize=(10, 10))
-    sns.tsplot(pd.melt(Table, id_vars = ['Sample']), ci=c_interval,
-        interpolate=True, color = color, time='variable', unit='Sample', value='value')
+    for i, name in enumerate(names):
+        plt.plot(positions, means[i, :], color=colors[i],
+                label=(str(name).split('/')[-1]).split('.')[0])
+        plt.fill_between(positions, lower[i, :], upper[i, :], color=colors[i], alpha=0.3, linewidth=0)
+    plt.legend(loc=1)
 
     plt.xlim([-xlim, xlim])
     plt.ylim([0, ylim])
@@ -62,7 +127,7 @@ if __name__ == '__main__':
     arguments = docopt(__doc__)
     FileName = arguments['<netcdf_out>']
     print("Generating heatmap from " + FileName)
-    File = xa.open_dataset(FileName)
+    File = open_coverage(FileName)
 
     Col = arguments['--color']
     print("Using matplotlib color scheme: " + str(Col))
@@ -77,7 +142,16 @@ if __name__ == '__main__':
     x_range = int(arguments['--x_range'])
     c_interval = int(arguments['--c_interval'])
 
-    fig = expected_average(File.Coverage, File.Coverage.coords['Sample'].to_pandas(), color=Col, xlim=xlim, ylim=ylim, x_range=x_range, c_interval=c_interval)
+    CImethod = str(arguments['--ci_method'])
+    if not CImethod in ['bootstrap', 'se']:
+        raise ValueError("Unknown method for confidence interval: " + CImethod)
+    ChunkSites = int(arguments['--chunk_sites'])
+    TableOut = arguments['--table_out']
+    if str(TableOut) == 'None':
+        TableOut = None
+
+    fig = expected_average(File.Coverage, File.Coverage.coords['Sample'].to_pandas(), color=Col, xlim=xlim, ylim=ylim, x_range=x_range, c_interval=c_interval,
+            ci_method=CImethod, chunk_sites=ChunkSites, table_out=TableOut)
 
     OutName = arguments['<fig_name>']
     print("Saving file: " + OutName)
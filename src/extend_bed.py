@@ -7,17 +7,12 @@ Usage:
 
 Options:
     --window=<window-size>  Size of genomic locations [default: 1000].
-    --Ref_ver=<ref_ver>     Reference genome version [default: hg19].
+    --Ref_ver=<ref_ver>     Reference genome version, or a file with chromosome sizes [default: hg19].
+    --chunk_rows=<rows>     Number of sites read and extended at a time [default: 1000000].
 """
 
 from docopt import docopt
-import pybedtools
-
-# function for obtaining center of genomic locations
-def midpoint_generator(bedfile):
-    from pybedtools.featurefuncs import midpoint
-    for interval in bedfile:
-        yield midpoint(interval)
+from util_bed import iter_bed, write_bed, chrom_sizes, midpoint_window
 
 
 # main 
@@ -29,15 +24,17 @@ if __name__ == '__main__':
     WinSize = int(arguments['--window'])
     genome_ver = arguments['--Ref_ver']
     outfile = arguments['<out_file>']
+    ChunkRows = int(arguments['--chunk_rows'])
 
     print("Identifying +/- " + str(WinSize) + "bp from center of sites in " + str(bedfile))
     print("Reference genome :" + genome_ver)
 
-    #identify sites
-    Sites = pybedtools.BedTool(bedfile)
-    MidSites = pybedtools.BedTool(midpoint_generator(Sites))
-    Sites = MidSites.slop(b=WinSize, genome=genome_ver)
-
+    #identify sites, chunk by chunk
+    sizes = chrom_sizes(genome_ver)
     print("Save at " + str(outfile))
-    Sites.saveas(outfile)
+    with open(outfile, 'w') as f:
+        for Sites in iter_bed(bedfile, chunk_rows=ChunkRows):
+            Sites['start'], Sites['end'] = midpoint_window(Sites.chrom.values, Sites.start.values,
+                    Sites.end.values, WinSize, sizes)
+            write_bed(Sites, f)
 
@@ -14,17 +14,58 @@ Options:
     --blue=<blue>   Endpoint color of custom color gradient. Ignored if not color=Custom [default: 0.5].
     --limit=<grad_limit>    Gradient limit of read count [default: 20].
     --sort=<sort_index>    Sort regions based on the signal level of a particular sample (index). Use 0 for not sorting [default: 0].
+    --max_rows=<max_rows>   Number of pixel rows of each heatmap. Regions are pooled to this resolution. Use None for full resolution [default: None].
+    --max_cols=<max_cols>   Number of pixel columns of each heatmap. Positions are pooled to this resolution. Use None for full resolution [default: None].
+    --pooling=<pooling>     Pooling used for downsampling, either mean or max [default: mean].
+    --chunk_sites=<chunk_sites>    Number of regions read from the file at once [default: 10000].
 """
 
 
 from docopt import docopt
 import matplotlib
-import xarray as xa
+from util_netcdf import open_coverage
 import ast
 import numpy as np
+from util_profile import bin_profile
+
+
+# function for calculating sort key (negative total signal of each region) of a sample chunk by chunk
+def sort_key(array, index, chunk_sites=10000):
+    Ncoord = array.shape[1]
+    key = np.zeros(Ncoord)
+    for lo in range(0, Ncoord, chunk_sites):
+        block = np.asarray(array[index, lo:lo+chunk_sites, :], dtype=np.float64)
+        key[lo:lo+block.shape[0]] = -block.sum(axis=1)
+    return key
+
+
+# function for reading a sample chunk by chunk and pooling it into (nrows, ncols) image
+# rank gives the row of each region in the image before pooling
+def pooled_image(array, index, rank, nrows, ncols, pooling='mean', chunk_sites=10000):
+    Ncoord = array.shape[1]
+    image = np.zeros((nrows, ncols))
+    if pooling == 'max':
+        image[:] = -np.inf
+    else:
+        Nrows = np.bincount(rank * nrows // Ncoord, minlength=nrows)
+
+    for lo in range(0, Ncoord, chunk_sites):
+        block = np.asarray(array[index, lo:lo+chunk_sites, :], dtype=np.float64)
+        block = bin_profile(block, ncols, pooling)
+        rows = rank[lo:lo+block.shape[0]] * nrows // Ncoord
+        if pooling == 'max':
+            np.maximum.at(image, rows, block)
+        else:
+            np.add.at(image, rows, block)
+
+    if pooling == 'max':
+        image[np.isinf(image)] = 0
+    else:
+        image /= np.maximum(Nrows, 1)[:, np.newaxis]
+    return image
 
 
-def seqminer(array, names, color='Reds', lim=20, sort=0):
+def seqminer(array, names, color='Reds', lim=20, sort=0, max_rows=None, max_cols=None, pooling='mean', chunk_sites=10000):
     import matplotlib.pyplot as plt
     from mpl_toolkits.axes_grid1 import AxesGrid
     plt.rcParams['font.family'] = 'Arial'
@@ -45,15 +86,20 @@ def seqminer(array, names, color='Reds', lim=20, sort=0):
             cbar_pad = 1
             )
 
+    Ncoord, Npos = array.shape[1], array.shape[2]
+    nrows = Ncoord if max_rows is None else min(max_rows, Ncoord)
+    ncols = Npos if max_cols is None else min(max_cols, Npos)
+    aspect = (Ncoord / float(nrows)) / (Npos / float(ncols))
+
+    rank = np.arange(Ncoord)
     if sort > 0:
-        order = np.argsort(np.sum(-array[sort-1,:,:], axis=1))
+        order = np.argsort(sort_key(array, sort-1, chunk_sites), kind='stable')
+        rank[order] = np.arange(Ncoord)
 
 
     for i, name in zip(range(len(names)), names):
-        if sort == 0:
-            im = grid[i].imshow(array[i,:,:], interpolation="none", cmap=color, clim=(0.0, lim))
-        else:
-            im = grid[i].imshow(array[i,order,:], interpolation="none", cmap=color, clim=(0.0, lim))
+        image = pooled_image(array, i, rank, nrows, ncols, pooling, chunk_sites)
+        im = grid[i].imshow(image, interpolation="none", cmap=color, clim=(0.0, lim), aspect=aspect)
 
         grid[i].get_xaxis().set_visible(False)
         grid[i].get_yaxis().set_visible(False)
@@ -67,7 +113,7 @@ if __name__ == '__main__':
     arguments = docopt(__doc__)
     FileName = arguments['<netcdf_out>']
     print("Generating heatmap from " + FileName)
-    File = xa.open_dataset(FileName)
+    File = open_coverage(FileName)
 
     Col = arguments['--color']
     print("Using matplotlib color scheme: " + str(Col))
@@ -83,8 +129,17 @@ if __name__ == '__main__':
     sort = int(arguments['--sort'])
     print("Color gradient limit: " + str(Limit))
 
+    MaxRows = ast.literal_eval(arguments['--max_rows'])
+    MaxCols = ast.literal_eval(arguments['--max_cols'])
+    Pooling = str(arguments['--pooling'])
+    ChunkSites = int(arguments['--chunk_sites'])
+    if not Pooling in ['mean', 'max']:
+        raise ValueError("Unknown pooling: " + Pooling)
+    print("Heatmap resolution (rows, columns): (" + str(MaxRows) + ", " + str(MaxCols) + "), " + Pooling + " pooling")
+
     matplotlib.use('Agg')
-    fig = seqminer(File.Coverage, File.Coverage.coords['Sample'].to_pandas(), color=Col, lim=Limit, sort=sort)
+    fig = seqminer(File.Coverage, File.Coverage.coords['Sample'].to_pandas(), color=Col, lim=Limit, sort=sort,
+            max_rows=MaxRows, max_cols=MaxCols, pooling=Pooling, chunk_sites=ChunkSites)
 
     OutName = arguments['<fig_name>']
     print("Saving file: " + OutName)
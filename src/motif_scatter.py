@@ -9,6 +9,10 @@ Options:
     --name1=<name1>    Name for the first table [default: Group1].
     --name2=<name2>    Name for the first table [default: Group2].
     --axis_min=<axis_min>    Minimum axis value in the scatter plot [default: 0].
+    --render=<render>    Rendering of motifs. points (rasterized points colored by family), hexbin or hist2d (counts of motifs in a fixed grid) [default: points].
+    --gridsize=<gridsize>    Number of bins along each axis for hexbin and hist2d rendering [default: 100].
+    --max_labels=<max_labels>    Maximum number of motif names shown, in order of Z score. All if not specified [default: All].
+    --label_grid=<label_grid>    Show at most one motif name per cell of the plot divided into label_grid x label_grid cells. 0 shows all names [default: 0].
 """
 
 from docopt import docopt
@@ -25,6 +29,7 @@ from matplotlib import pyplot as plt
 import seaborn as sns
 import pandas as pd
 import matplotlib.patches as mpatches
+from util_render import render_points, thin_labels, RENDERS
 
 
 def SeqpostoPanda(htmlpath):
@@ -64,7 +69,7 @@ def get_spaced_colors(n):
     return [(int(i[:2], 16), int(i[2:4], 16), int(i[4:], 16)) for i in colors]
 
 
-def draw_scatter(html1, html2, name1, name2, axis_min):
+def draw_scatter(html1, html2, name1, name2, axis_min, render='points', gridsize=100, max_labels=None, label_grid=0):
     table1 = SeqpostoPanda(html1)
     table2 = SeqpostoPanda(html2)
 
@@ -120,13 +125,20 @@ def draw_scatter(html1, html2, name1, name2, axis_min):
     for color,key in zip(temp_color,keys):
         colors[key] = color
 
-    for family, z1, z2, symbol in zip(Table.Family, Table["Z score ("+name1+")"],
-            Table["Z score ("+name2+")"], Table.Symbol):
-        if family in keys:
-            grid.ax_joint.plot(z1, z2, marker = 'o', color = colors[family])
-        else:
-            grid.ax_joint.plot(z1, z2, marker = 'o', color = 'k')
-        grid.ax_joint.text(z1, z2, symbol)
+    z1 = Table["Z score ("+name1+")"].values.astype(float)
+    z2 = Table["Z score ("+name2+")"].values.astype(float)
+    if render == 'points':
+        # one rasterized scatter per family, the others in black
+        infamily = Table.Family.isin(keys).values
+        grid.ax_joint.scatter(z1[~infamily], z2[~infamily], marker='o', color='k', rasterized=True)
+        for key in keys:
+            sel = (Table.Family == key).values
+            grid.ax_joint.scatter(z1[sel], z2[sel], marker='o', color=colors[key], rasterized=True)
+    else:
+        render_points(grid.ax_joint, z1, z2, render=render, gridsize=gridsize)
+
+    for i in thin_labels(z1, z2, np.maximum(z1, z2), grid=label_grid, max_labels=max_labels):
+        grid.ax_joint.text(z1[i], z2[i], Table.Symbol.values[i])
 
     # put label
     markers=[]
@@ -151,13 +163,21 @@ if __name__ == '__main__':
     name1 = arguments['--name1']
     name2 = arguments['--name2']
     axis_min = float(arguments['--axis_min'])
+    render = str(arguments['--render'])
+    gridsize = int(arguments['--gridsize'])
+    max_labels = None if arguments['--max_labels'] == 'All' else int(arguments['--max_labels'])
+    label_grid = int(arguments['--label_grid'])
+
+    if not render in RENDERS:
+        raise ValueError("Unknown render mode: " + render)
     outfile = arguments['<outfile>']
 
     print("Comparing Z-scores from two tables:")
     print( table1+"("+name1+")" )
     print( table2+"("+name2+")" )
 
-    f =  draw_scatter(table1, table2, name1, name2, axis_min=axis_min)
+    f =  draw_scatter(table1, table2, name1, name2, axis_min=axis_min,
+            render=render, gridsize=gridsize, max_labels=max_labels, label_grid=label_grid)
     print("Saving output at " + outfile)
     f.savefig(outfile, bbox_inches="tight", dpi=300)
 
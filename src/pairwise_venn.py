@@ -21,15 +21,24 @@ matplotlib.use('Agg')
 from matplotlib_venn import venn2
 from matplotlib_venn import venn2_circles
 from matplotlib import pyplot as plt
-import pybedtools
+from util_bed import read_bed
+from util_interval import build_index, count_overlaps
+
+
+# function for reading coordinates of a bed file with its interval index
+def load_sites(bedfile):
+    bed = read_bed(bedfile, coords_only=True)
+    Site = (bed.chrom.values, bed.start.values, bed.end.values)
+    return Site, build_index(*Site)
 
 
 def two_way_venn(bedfiles, names, colors):
-    Site1 = pybedtools.BedTool(bedfiles[0])
-    Site2 = pybedtools.BedTool(bedfiles[1])
-    Int = Site1.intersect(Site2, wa=True)
+    Site1, Index1 = load_sites(bedfiles[0])
+    Site2, Index2 = load_sites(bedfiles[1])
+    # number of overlapping pairs (lines of intersect -wa)
+    Int = count_overlaps(Index2, *Site1).sum()
 
-    Sets=(len(Site1)-len(Int), len(Site2)-len(Int), len(Int))
+    Sets=(len(Site1[0])-Int, len(Site2[0])-Int, Int)
 
     fig = plt.figure(figsize=(5,5))
     v = venn2(subsets=Sets,  set_labels = names)
@@ -42,14 +51,15 @@ def two_way_venn(bedfiles, names, colors):
     return fig
 
 def three_way_venn(bedfiles, names, colors):
-    Site1 = pybedtools.BedTool(bedfiles[0])
-    Site2 = pybedtools.BedTool(bedfiles[1])
-    Site3 = pybedtools.BedTool(bedfiles[2])
-
-    Int12 = Site1.intersect(Site2, wa=True)
-    Int23 = Site2.intersect(Site3, wa=True)
-    Int31 = Site3.intersect(Site1, wa=True)
-    Int123 = Int12.intersect(Site3, wa=True)
+    Site1, Index1 = load_sites(bedfiles[0])
+    Site2, Index2 = load_sites(bedfiles[1])
+    Site3, Index3 = load_sites(bedfiles[2])
+
+    Count12 = count_overlaps(Index2, *Site1)
+    Int12 = Count12.sum()
+    Int23 = count_overlaps(Index3, *Site2).sum()
+    Int31 = count_overlaps(Index1, *Site3).sum()
+    Int123 = (Count12 * count_overlaps(Index3, *Site1)).sum()
 
 #    Sets=
 # main
@@ -8,44 +8,34 @@ Options:
     --datatype=<dtype>  Data type to be obatiend. Either of bigwig, bed and both.    [default: both]
     --threshold=<thr> Threshold used for selecting peak lists.    [default: 05]
     --filtermeta=<filter>   Include features with specific string pattern.  [default: No]
+    --cache=<cache>   Directory for the cached table. In default, ~/.cache/chipseq_analysis/chipatlas (or ATLAS_CACHE) is used.  [default: Default]
+    --refresh=<refresh>   Check if the table was updated (Yes), or use the cached table if any (No).  [default: Yes]
+    --cores=<cores>   Number of concurrent downloads.  [default: 8]
+    --manifest=<manifest>   Json file recording completed downloads, which are skipped when rerun. In default, <prefix>/manifest.json is used.  [default: Default]
 """
 
 import docopt
-import pandas as pd
-import urllib as url
-import os
+from util_download import download_files
+from util_metadata import load_table, select, CACHE
 
 if __name__=='__main__':
     arguments = docopt.docopt(__doc__)
 
     tableName = str(arguments['--table'])
-    print("Parsing table: " + tableName)
-
-    table = pd.read_csv(tableName, sep='\t', usecols=range(0,13),
-            header=None, names = ['ID', 'assembly', 'AntigenClass',
-                'Antigen', 'CellTypeClass', 'CellType', 'CellDescription',
-                'ProcessLog', 'Title', 'MetaDataByAuthor',
-                'MetaData2', 'MetaData3', 'MetaData4'
-                ])
+    cachedir = str(arguments['--cache'])
+    if cachedir == 'Default':
+        cachedir = CACHE
+    table, Index = load_table(tableName, cachedir=cachedir, refresh=arguments['--refresh'] == 'Yes')
 
     celltype = str(arguments['<celltype>'])
     print("Filtering table element by cell type: " + celltype)
-    ind_cellType = table.CellType == celltype
 
     if not str(arguments['--filtermeta']).strip() == 'No':
         filter = str(arguments['--filtermeta']).strip().split(',')
         print("Filtering table with the following filters: " + ','.join(filter))
-
-        ind_filter = table.CellType == -1
-        for string in filter:
-            print(string)
-            ind_filter = ind_filter | (table.MetaDataByAuthor.str.contains(string) | \
-                table.MetaData2.str.contains(string) | \
-                table.MetaData3.str.contains(string) | \
-                table.MetaData4.str.contains(string))
-        ind_final = ind_cellType & ind_filter
+        ind_final = select(table, Index, celltype=celltype, keywords=filter)
     else:
-        ind_final = ind_cellType
+        ind_final = select(table, Index, celltype=celltype)
 
     print(str(ind_final.sum()) + " entries remained")
     table = table[ind_final]
@@ -57,34 +47,30 @@ if __name__=='__main__':
 
     datatype = str(arguments['--datatype'])
     thr = str(arguments['--threshold'])
+    jobs = []
     # obtaining bed files
     if datatype in  ['both', 'bed']:
-        if not os.path.exists(prefix + '/bed'):
-           os.makedirs(prefix + '/bed')
         print("obtaining bed files with Q value threshold 10e-" + thr + " from the table.")
         for ID, genome  in zip(table.ID, table.assembly):
             address = 'http://dbarchive.biosciencedbc.jp/kyushu-u/' +\
                     genome + "/eachData/bed" + thr + '/' + ID + "." + thr + '.bed'
             local = prefix + '/bed/' + ID + '.' + thr + '.bed'
-            if not os.path.isfile(local):
- #               try:
-                url.urlretrieve(address, local)
-#                except url.ContentTooShortError:
-#                    print(ID)
-#                    raise
+            jobs.append((address, local))
 
     # obtaining bigwig
     if datatype in  ['both', 'bigwig']:
-        if not os.path.exists(prefix + '/bigwig'):
-            os.makedirs(prefix + '/bigwig')
         print("obtaining bigwig files from the table.")
         for ID, genome  in zip(table.ID, table.assembly):
             address = 'http://dbarchive.biosciencedbc.jp/kyushu-u/' +\
                     genome + "/eachData/bw/" + ID + ".bw"
             local = prefix + '/bigwig/' + ID + '.bw'
-            if not os.path.isfile(local):
- #               try:
-                url.urlretrieve(address, local)
- #               except url.ContentTooShortError:
- #                   print(ID)
+            jobs.append((address, local))
+
+    manifest = str(arguments['--manifest'])
+    if manifest == 'Default':
+        manifest = prefix + '/manifest.json'
 
+    failed = download_files(jobs, manifest=manifest, max_workers=int(arguments['--cores']))
+    if len(failed) > 0:
+        raise Exception(str(len(failed)) + " files could not be downloaded: " + \
+                ', '.join(address for address, error in failed))
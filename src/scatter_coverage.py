@@ -8,9 +8,11 @@ Usage:
 Options:
     --hlsites=<hlsites>    Obtain sties from a bed file and highlight the points in scatter plots that overlap with the sites. [default: None].
     --index_name=<index_name>    Index of feature name in the bed file for highlighting (specified by hlsites). [default: 4].
-    --measure=<measure>   Coverage measures. FPKM or CPM. [default: FPKM].
+    --measure=<measure>   Coverage measures (natural log-transformed). FPKM, CPM, TPM, SizeFactor or Raw. [default: FPKM].
     --title=<title>   Title of the plot. [default: ScatterPlot].
     --kind=<kind>   Type of plot, all options in jointplot of seaborn supported (e.g. reg, scatter) [default: scatter].
+    --render=<render>   Rendering of sites. points (kind of jointplot with rasterized points), hexbin or hist2d (counts of sites in a fixed grid, for many sites) [default: points].
+    --gridsize=<gridsize>   Number of bins along each axis for hexbin and hist2d rendering [default: 100].
 """
 
 from docopt import docopt
@@ -18,98 +20,70 @@ import matplotlib
 matplotlib.use('Agg')
 import ast
 import numpy as np
-import pybedtools as pb
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-import concurrent.futures as cf
 import matplotlib.patches as mpatches
-import pysam
-
-def readcount(site, pathtobam, order):
-    read = pb.BedTool.coverage(site, pathtobam, counts=True)
-    return order, read
-
-def flagstats(bamfile, order):
-    from subprocess import Popen, PIPE
-    p = Popen(['samtools', 'flagstat', bamfile], stdout=PIPE)
-    for line in p.stdout:
-        if "mapped" in line:
-            nmapped = line.rstrip().split()
-            nmapped = int(nmapped[0])
-            break
-    return nmapped, order
+from util_readcount import site_index, count_reads
+from util_libsize import library_sizes
+from util_normalize import normalize, MEASURES
+from util_bed import read_bed
+from util_sites import prepare_sites
+from util_interval import build_index, all_hits
+from util_render import render_points, render_marginals, RENDERS
 
 def create_array(Bedfiles, Bamfiles, measure, max_workers=15):
-    PyBedfiles = dict()
     colname = [None] * len(Bamfiles)
 
-    # create bedfiles
-    print("Collecting bedfiles... ")
-    for i,Bedfile in zip(range(len(Bedfiles)),Bedfiles):
-        print("Obtaining " + Bedfile)
-        PyBedfiles[Bedfile] = pb.BedTool(Bedfile)
-
     for i, Bamfile in enumerate(Bamfiles):
         colname[i] = (Bamfile.split('/')[-1]).split('.')[0]
 
-    print("Obtaining unions of binding sites")
-    UnionSite = PyBedfiles[Bedfile]
-    for Bedfile in PyBedfiles:
-        UnionSite = UnionSite.cat(PyBedfiles[Bedfile])
+    Sites = prepare_sites(Bedfiles, union=True)
 
     # reading bam reads
-    bamreads = [None]*len(Bamfiles)
-    futures = []
+    Index, lengths = site_index(*Sites.coords())
     print("Calculating read counts from bam files")
-    with cf.ThreadPoolExecutor(max_workers=max_workers) as e:
-        for order in range(len(Bamfiles)):
-            futures.append(e.submit(readcount, UnionSite, Bamfiles[order], order))
-
-        for future in cf.as_completed(futures):
-            order, read = future.result()
-            bamreads[order] = read
+    reads = count_reads(Index, len(lengths), Bamfiles, max_workers=max_workers)
 
-    counts = np.zeros((len(UnionSite), len(Bamfiles)))
     # measuring total number of reads
 
-    Nreads = [pysam.AlignmentFile(bam).mapped for bam in Bamfiles]
+    Nreads = library_sizes(Bamfiles, max_workers=max_workers)
     print(Nreads)
 
-    if measure == "FPKM":
-        print("Calculating FPKM")
-        for i in range(len(Bamfiles)):
-            for j, site in enumerate(bamreads[i]):
-                counts[j,i] = np.log(1+float(site[-1])*(1000000000/Nreads[i])/float(site.length))
-
-    elif measure == "CPM":
-        print("Calculating CPM")
-        for i in range(len(Bamfiles)):
-            for j, site in enumerate(bamreads[i]):
-                counts[j,i] = np.log(1+float(site[-1])*1000000.0/float(Nreads[i]))
+    print("Calculating " + measure)
+    counts = normalize(reads, lengths, Nreads, measure=measure, base=np.e)
 
-    return counts, colname, UnionSite
+    return counts, colname, Sites
 
 
-def draw_scatter(x, y, xname, yname, sites, index_highlight, title, kind="scatter"):
+def draw_scatter(x, y, xname, yname, site_idx, labels, title, kind="scatter", render='points', gridsize=100):
     # generate figure
     f = plt.figure(figsize=(11,9))
     sns.set(style="white", color_codes=True)
 
     Table = pd.concat([pd.Series(x), pd.Series(y)], axis=1)
     Table.columns = [xname, yname]
-    grid = sns.jointplot(xname, yname, data=Table, kind=kind, color='k')
+    if render == 'points':
+        grid = sns.jointplot(xname, yname, data=Table, kind=kind, color='k')
+        for artist in grid.ax_joint.collections:
+            artist.set_rasterized(True)
+    else:
+        grid = sns.JointGrid(xname, yname, data=Table)
+        render_points(grid.ax_joint, x, y, render=render, gridsize=gridsize)
+        render_marginals(grid, x, y, bins=gridsize)
    # grid.ax_joint.plot([-1,max(x)*1.1],[-1,max(y)*1.1], 'r--')
     grid.ax_marg_x.set_title(title)
 
-    HL_names = list(set(index_highlight.values()))
+    HL_names = np.unique(labels)
     colors = sns.color_palette(n_colors=len(HL_names)).as_hex()
     col_dict = dict()
     for i, name in enumerate(HL_names):
         col_dict[name] = colors[i]
 
-    for col,ind in zip(colors,index_highlight):
-        grid.ax_joint.plot(x[ind], y[ind], marker= 'o', color = col_dict[index_highlight[ind]])
+    # one scatter call per label
+    for name in HL_names:
+        ind = site_idx[labels == name]
+        grid.ax_joint.scatter(x[ind], y[ind], marker='o', color=col_dict[name], rasterized=True)
 
 
     markers = []
@@ -126,19 +100,37 @@ def draw_scatter(x, y, xname, yname, sites, index_highlight, title, kind="scatte
     return grid
 
 
-# site = sites (pybedtool) used for scatter plot
-# hlsite = sites (pybedtool) to be highlighted
+# sites = (chroms, starts, ends) of sites used for scatter plot
+# hlsites = sites (dataframe of bed file) to be highlighted
 # index_name = index to feature names in hlsite
+# each highlight site labels the first site it overlaps (and sites with identical coordinates),
+# with later highlight sites overriding earlier ones; returns (site indices, labels)
 def index_hlsearch(sites, hlsites, index_name):
-    index_highlight = dict()
-    for hlsite in hlsites:
-        hit = sites.all_hits(hlsite)
-        if len(hit) > 0:
-            hit = hit[0]
-            for i,site in enumerate(sites):
-                if site[0] == hit[0] and site[1] == hit[1] and site[2] == hit[2]:
-                    index_highlight[i] = hlsite[index_name]
-    return index_highlight
+    chroms, starts, ends = sites
+    Index = build_index(chroms, starts, ends)
+    query, hit = all_hits(Index, hlsites.iloc[:, 0].values, hlsites.iloc[:, 1].values,
+            hlsites.iloc[:, 2].values)
+    if len(query) == 0:
+        return np.zeros(0, int), np.zeros(0, object)
+    query, first = np.unique(query, return_index=True)
+    hit = hit[first]
+
+    # expand hits to all sites with identical coordinates
+    group = pd.DataFrame({'chrom': chroms, 'start': starts, 'end': ends}).groupby(
+            ['chrom', 'start', 'end'], sort=False).ngroup().values
+    members = np.argsort(group, kind='stable')
+    bounds = np.searchsorted(group[members], np.arange(len(group)+1))
+    lo = bounds[group[hit]]
+    lengths = bounds[group[hit]+1] - lo
+    query = np.repeat(query, lengths)
+    site_idx = members[np.repeat(lo, lengths) + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)]
+
+    # the last highlight site wins for each site
+    order = np.lexsort((query, site_idx))
+    last = np.r_[site_idx[order][1:] != site_idx[order][:-1], True]
+    site_idx = site_idx[order][last]
+    labels = hlsites.iloc[:, index_name].values[query[order][last]]
+    return site_idx, labels
 
 
 # main function start
@@ -150,30 +142,36 @@ if __name__ == '__main__':
     measure = str(arguments['--measure'])
     kind = str(arguments['--kind'])
     title = str(arguments['--title'])
+    render = str(arguments['--render'])
+    gridsize = int(arguments['--gridsize'])
 
     # highlight
     hlsites = arguments['--hlsites']
 
-    if measure not in ['FPKM', 'CPM']:
+    if measure not in MEASURES:
         raise   ValueError("Unknown measure: " + str(measure))
 
+    if render not in RENDERS:
+        raise ValueError("Unknown render mode: " + str(render))
+
     print("Coverage measure: " + str(measure))
     print("Calculating coverages...")
-    counts, colname, UnionSite = create_array(Bedfiles, Bamfiles, measure, max_workers=2)
+    counts, colname, Sites = create_array(Bedfiles, Bamfiles, measure, max_workers=2)
 
     # identify sites to be highlighted:
     if hlsites == "None":
         print("No features are highlighted")
-        index_highlight = dict()
+        site_idx, labels = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=object)
     else:
         print("Features overlap with sites in " + str(hlsites) + " will be highlighted")
-        hlsites = pb.BedTool(hlsites)
+        hlsites = read_bed(hlsites)
         index_name = int(arguments['--index_name'])
-        index_highlight = index_hlsearch(UnionSite, hlsites, index_name)
+        site_idx, labels = index_hlsearch(Sites.coords(), hlsites, index_name)
 
 
     print("Producing scatter plot")
-    fig = draw_scatter(counts[:,0], counts[:,1], colname[0], colname[1], UnionSite, index_highlight, title, kind=kind)
+    fig = draw_scatter(counts[:,0], counts[:,1], colname[0], colname[1], site_idx, labels, title, kind=kind,
+            render=render, gridsize=gridsize)
     print("Saving figure at :" + Outfile)
     fig.savefig(Outfile, dpi=100, bbox_inches="tight")
 
@@ -0,0 +1,249 @@
+"""Read bed files into tables of columns.
+
+Bed files are parsed with pandas into DataFrames with the same column names
+as pybedtools' BedTool.to_dataframe(), so that coordinates can be handled as
+numpy arrays without creating an Interval object per site. Large bed files
+can be streamed in chunks of rows, and sites are resized (midpoint + slop)
+on whole columns. SiteTable keeps a set of sites as contiguous arrays.
+
+As in pybedtools, track, browser and comment (#) lines are skipped; a #
+within a field is kept as part of the field.
+"""
+
+import os
+import gzip
+import json
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 1000000
+
+# prefixes of lines that are not sites
+HEADER_PREFIXES = ('#', 'track', 'browser')
+
+BED_COLUMNS = ['chrom', 'start', 'end', 'name', 'score', 'strand',
+        'thickStart', 'thickEnd', 'itemRgb', 'blockCount', 'blockSizes', 'blockStarts']
+
+
+class BedLines(object):
+    """File-like object of the site lines of a bed file (.gz or plain text).
+
+    Blocks of whole lines are read from the file, and only blocks with a
+    header (track, browser or #) line are filtered line by line.
+    """
+
+    def __init__(self, Bedfile, block_size=1 << 20):
+        self.f = gzip.open(Bedfile, 'rt') if str(Bedfile).endswith('.gz') else open(Bedfile)
+        self.block_size = block_size
+        self.rest = ''
+
+    def read(self, size=-1):
+        while True:
+            block = self.f.read(self.block_size)
+            text = self.rest + block
+            if block == '':
+                self.rest = ''
+                return _site_lines(text)
+            cut = text.rfind('\n') + 1
+            text, self.rest = text[:cut], text[cut:]
+            text = _site_lines(text)
+            if text != '':
+                return text
+
+    def __iter__(self):
+        return iter(lambda: self.read(), '')
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _site_lines(text):
+    if not text.startswith(HEADER_PREFIXES) and \
+            not any('\n' + prefix in text for prefix in HEADER_PREFIXES):
+        return text
+    return ''.join(line for line in text.splitlines(True) if not line.startswith(HEADER_PREFIXES))
+
+
+# function for reading a bed file, only the first three columns are read if coords_only
+# and only the first nrows sites if nrows is given
+def read_bed(Bedfile, coords_only=False, nrows=None):
+    usecols = [0, 1, 2] if coords_only else None
+    with BedLines(Bedfile) as f:
+        try:
+            df = pd.read_csv(f, sep='\t', header=None, usecols=usecols,
+                    dtype={0: str, 1: np.int64, 2: np.int64}, nrows=nrows)
+        except pd.errors.EmptyDataError:
+            return empty_bed()
+    return _name_columns(df)
+
+
+# table of no sites (e.g. of a bed file without peaks)
+def empty_bed():
+    return pd.DataFrame({'chrom': np.array([], dtype=object), 'start': np.array([], dtype=np.int64),
+            'end': np.array([], dtype=np.int64)}, columns=['chrom', 'start', 'end'])
+
+
+def _name_columns(df):
+    df.columns = BED_COLUMNS[:df.shape[1]] + \
+            [str(i) for i in range(len(BED_COLUMNS), df.shape[1])]
+    return df
+
+
+# function for reading a bed file in chunks of chunk_rows sites
+# columns other than coordinates are kept as text, so that they are written back unchanged
+def iter_bed(Bedfile, chunk_rows=CHUNK_ROWS):
+    with BedLines(Bedfile) as f:
+        try:
+            reader = pd.read_csv(f, sep='\t', header=None, dtype=str,
+                    keep_default_na=False, chunksize=chunk_rows)
+        except pd.errors.EmptyDataError:
+            return
+        for df in reader:
+            df = _name_columns(df)
+            df['start'] = df.start.astype(np.int64)
+            df['end'] = df.end.astype(np.int64)
+            yield df
+
+
+# function for writing (appending) sites to an open bed file
+def write_bed(df, f):
+    df.to_csv(f, sep='\t', header=False, index=False)
+
+
+# function for obtaining chromosome sizes {chrom: size} of a genome
+# genome is either a file with chromosome names and sizes (e.g. .genome, .fai) or an assembly name (e.g. hg19)
+def chrom_sizes(genome):
+    if os.path.isfile(genome):
+        sizes = pd.read_csv(genome, sep='\t', header=None, usecols=[0, 1], dtype={0: str, 1: np.int64})
+        return dict(zip(sizes[0], sizes[1]))
+
+    import pybedtools
+    return dict((chrom, interval[1]) for chrom, interval in pybedtools.chromsizes(genome).items())
+
+
+# function for obtaining +/- window bp around the midpoint of sites, clipped to chromosome sizes
+# as pybedtools' midpoint followed by bedtools slop -b window; returns (starts, ends)
+def midpoint_window(chroms, starts, ends, window, sizes):
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    names, codes = np.unique(np.asarray(chroms).astype(str), return_inverse=True)
+    missing = [name for name in names if not name in sizes]
+    if len(missing) > 0:
+        raise ValueError("Chromosomes not found in the genome: " + ', '.join(missing))
+    chromsize = np.array([sizes[name] for name in names], dtype=np.int64)[codes]
+
+    mid = starts + (ends - starts) // 2
+    return np.maximum(mid - window, 0), np.minimum(mid + 1 + window, chromsize)
+
+
+# function for grouping rows by chromosome: {chrom: row indices}
+def chrom_groups(chroms):
+    chroms = np.asarray(chroms)
+    codes, uniques = pd.factorize(chroms)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques)+1))
+    return dict((chrom, order[bounds[i]:bounds[i+1]]) for i, chrom in enumerate(uniques))
+
+
+class SiteTable(object):
+    """Sites held as contiguous arrays.
+
+    Chromosomes are stored as int32 codes into a sorted array of names, and
+    coordinates as int64 starts and ends. Other bed columns (e.g. name, score,
+    strand) are kept as optional arrays in columns. Slicing returns a table of
+    views on the same arrays, and tables saved with save() are loaded as
+    memory-mapped arrays.
+    """
+
+    def __init__(self, names, codes, starts, ends, columns=None):
+        self.names = np.asarray(names).astype(str)
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.columns = dict() if columns is None else columns
+
+    @classmethod
+    def from_arrays(cls, chroms, starts, ends, columns=None):
+        codes, names = pd.factorize(np.asarray(chroms).astype(str), sort=True)
+        return cls(names, codes, starts, ends, columns)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        columns = dict((column, np.asarray(df[column].values)) for column in df.columns[3:])
+        return cls.from_arrays(df.iloc[:, 0].values, df.iloc[:, 1].values, df.iloc[:, 2].values, columns)
+
+    @classmethod
+    def from_bed(cls, Bedfile, coords_only=False):
+        return cls.from_dataframe(read_bed(Bedfile, coords_only=coords_only))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, key):
+        return SiteTable(self.names, self.codes[key], self.starts[key], self.ends[key],
+                dict((column, values[key]) for column, values in self.columns.items()))
+
+    @property
+    def chroms(self):
+        return self.names[self.codes]
+
+    # (chroms, starts, ends) arrays
+    def coords(self):
+        return self.chroms, self.starts, self.ends
+
+    def lengths(self):
+        return self.ends - self.starts
+
+    # sites sorted by chromosome (by name, or by chrom_order with other chromosomes last), start and end
+    def sort(self, chrom_order=None):
+        if chrom_order is None:
+            ranks = np.argsort(np.argsort(self.names))
+        else:
+            rank = dict((chrom, i) for i, chrom in enumerate(chrom_order))
+            ranks = np.array([rank.get(name, len(rank)) for name in self.names], dtype=np.int64)
+        return self[np.lexsort((self.ends, self.starts, ranks[self.codes]))]
+
+    # union of overlapping (or book-ended) sites, sorted by chromosome name and start
+    def merge(self):
+        from util_occupancy import to_axis, from_axis, merge_clusters
+        names, starts, ends = to_axis(self.chroms, self.starts, self.ends)
+        (starts, ends), cluster = merge_clusters(starts, ends)
+        return SiteTable.from_arrays(*from_axis(names, starts, ends))
+
+    # function for saving arrays of the table as .npy files in directory path
+    def save(self, path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'codes.npy'), self.codes)
+        np.save(os.path.join(path, 'starts.npy'), self.starts)
+        np.save(os.path.join(path, 'ends.npy'), self.ends)
+        for i, (column, values) in enumerate(self.columns.items()):
+            if values.dtype == object:
+                values = np.asarray(pd.Series(values).fillna(''), dtype=str)
+            np.save(os.path.join(path, 'column' + str(i) + '.npy'), values)
+        with open(os.path.join(path, 'sites.json'), 'w') as f:
+            json.dump({'names': self.names.tolist(), 'columns': list(self.columns)}, f)
+
+    # function for loading a table saved in directory path, arrays are memory-mapped unless mmap_mode is None
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        with open(os.path.join(path, 'sites.json')) as f:
+            meta = json.load(f)
+        columns = dict((column, np.load(os.path.join(path, 'column' + str(i) + '.npy'), mmap_mode=mmap_mode))
+                for i, column in enumerate(meta['columns']))
+        return cls(meta['names'], np.load(os.path.join(path, 'codes.npy'), mmap_mode=mmap_mode),
+                np.load(os.path.join(path, 'starts.npy'), mmap_mode=mmap_mode),
+                np.load(os.path.join(path, 'ends.npy'), mmap_mode=mmap_mode), columns)
+
+    def to_dataframe(self):
+        df = pd.DataFrame({'chrom': self.chroms, 'start': self.starts, 'end': self.ends},
+                columns=['chrom', 'start', 'end'])
+        for column, values in self.columns.items():
+            df[column] = values
+        return df
@@ -0,0 +1,35 @@
+"""Load and save json caches of {key: entry}.
+
+Caches are written atomically (to a temporary file in the same directory,
+which then replaces the cache), so that an interrupted run never leaves a
+broken cache behind. A cache that cannot be parsed is ignored.
+"""
+
+import os
+import json
+from tempfile import NamedTemporaryFile as temp
+
+
+def load_json(path, description='cache'):
+    if path is None or not os.path.isfile(path):
+        return dict()
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        print("Ignoring broken " + description + ": " + path)
+        return dict()
+
+
+# with merge, entries are merged with the current cache (e.g. written by another run) before saving
+def save_json(entries, path, merge=True, **kwargs):
+    dirname = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    if merge:
+        cache = load_json(path)
+        cache.update(entries)
+        entries = cache
+    with temp('w', dir=dirname, delete=False) as f:
+        json.dump(entries, f, **kwargs)
+    os.replace(f.name, path)
@@ -0,0 +1,129 @@
+"""Download files concurrently with resume and verification.
+
+Files are fetched by a bounded pool of threads sharing one HTTP session, so
+that connections to the same host are reused. Data is written to a .part
+file next to the target and moved into place only after its size (and md5
+checksum, if given) is verified. An interrupted download is resumed with an
+HTTP Range request from the end of the .part file.
+
+Completed downloads are recorded in a json manifest ({local path: {url,
+size, md5}}), and files in the manifest that are still present with the
+recorded size are skipped on the next run.
+"""
+
+import os
+import hashlib
+import requests
+import concurrent.futures as cf
+from requests.adapters import HTTPAdapter
+from util_cache import load_json, save_json
+
+CHUNK_SIZE = 1 << 20
+
+
+# function for creating a session with a connection pool for max_workers threads
+def create_session(max_workers=8, retries=3):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def md5sum(path, chunk_size=CHUNK_SIZE):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+# function for checking if a file recorded in the manifest is complete
+def is_complete(entry, address, local):
+    return entry is not None and entry.get('url') == address and \
+            os.path.isfile(local) and os.path.getsize(local) == entry.get('size')
+
+
+# function for downloading address into local, resuming from local.part if present
+# returns manifest entry {url, size, md5}
+def download_file(session, address, local, md5=None, chunk_size=CHUNK_SIZE, timeout=60):
+    part = local + '.part'
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    headers = {'Range': 'bytes=' + str(offset) + '-'} if offset > 0 else {}
+
+    with session.get(address, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 416:
+            # nothing left to fetch beyond the end of the part file
+            total = response.headers.get('Content-Range', '*/' + str(offset)).split('/')[-1]
+            total = offset if total == '*' else int(total)
+            if total != offset:
+                os.remove(part)
+                raise IOError("Broken partial download of " + address + ", removed " + part)
+        else:
+            response.raise_for_status()
+            if response.status_code == 206:
+                total = int(response.headers['Content-Range'].split('/')[-1])
+                mode = 'ab'
+            else:
+                # server ignored the range request, start over
+                offset = 0
+                total = int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None
+                mode = 'wb'
+
+            with open(part, mode) as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+
+    size = os.path.getsize(part)
+    if total is not None and size != total:
+        raise IOError("Incomplete download of " + address + ": " + str(size) + " of " + str(total) + " bytes")
+
+    checksum = md5sum(part)
+    if md5 is not None and checksum != md5:
+        os.remove(part)
+        raise IOError("Checksum mismatch for " + address + ": " + checksum + " instead of " + md5)
+
+    os.replace(part, local)
+    return {'url': address, 'size': size, 'md5': checksum}
+
+
+# function for downloading jobs [(address, local) or (address, local, md5)] with max_workers threads
+# files already complete according to the manifest are skipped, and the manifest is updated as files finish
+# returns list of (address, error) of failed downloads
+def download_files(jobs, manifest=None, max_workers=8, session=None, timeout=60):
+    entries = load_json(manifest, 'download manifest')
+    if session is None:
+        session = create_session(max_workers)
+
+    pending = []
+    for job in jobs:
+        address, local = job[0], job[1]
+        if is_complete(entries.get(local), address, local):
+            continue
+        dirname = os.path.dirname(os.path.abspath(local))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        pending.append(job)
+    print(str(len(jobs) - len(pending)) + " files are already downloaded, " + str(len(pending)) + " files to be downloaded")
+
+    failed = []
+    done = 0
+    with cf.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = dict((executor.submit(download_file, session, job[0], job[1],
+                job[2] if len(job) > 2 else None, timeout=timeout), job) for job in pending)
+        for future in cf.as_completed(futures):
+            address, local = futures[future][0], futures[future][1]
+            try:
+                entry = future.result()
+            except (requests.RequestException, IOError) as e:
+                print("Failed to download " + address + ": " + str(e))
+                failed.append((address, e))
+                continue
+
+            done += 1
+            print("[" + str(done) + "/" + str(len(pending)) + "] " + local)
+            entries[local] = entry
+            if manifest is not None:
+                save_json(entries, manifest, merge=False, indent=1, sort_keys=True)
+
+    return failed
@@ -0,0 +1,168 @@
+"""Resolve GEO sample accessions to SRA experiments and runs with NCBI E-utilities.
+
+Accessions are resolved in batches: one esearch request (POST) finds the
+records of a batch of accessions, and one esummary request returns their
+document summaries, which are parsed while streaming with iterparse.
+
+    GSM -> SRX   gds document summaries, ExtRelations/TargetObject
+    SRX -> SRR   sra document summaries, Experiment@acc and Run@acc
+
+Mappings are cached in a SQLite database (tables gsm_srx and srx_srr), and
+only accessions not in the cache are sent to NCBI. The E-utilities base URL,
+cache file and API key can be specified with the ENTREZ_URL, ENTREZ_CACHE
+and NCBI_API_KEY environment variables.
+"""
+
+import os
+import time
+import sqlite3
+import xml.etree.ElementTree as ET
+from util_download import create_session
+
+EUTILS = os.environ.get('ENTREZ_URL', 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/')
+CACHE = os.environ.get('ENTREZ_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'chipseq_analysis', 'entrez.sqlite'))
+API_KEY = os.environ.get('NCBI_API_KEY')
+
+# NCBI allows 3 requests per second without API key (10 with)
+DELAY = 0.34 if API_KEY is None else 0.1
+# maximum number of host parameters in a sqlite query
+SQLITE_BATCH = 500
+
+
+def open_cache(cachefile=CACHE):
+    dirname = os.path.dirname(os.path.abspath(cachefile))
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    db = sqlite3.connect(cachefile, timeout=60)
+    db.execute('CREATE TABLE IF NOT EXISTS gsm_srx (gsm TEXT PRIMARY KEY, srx TEXT)')
+    db.execute('CREATE TABLE IF NOT EXISTS srx_srr (srx TEXT, srr TEXT, PRIMARY KEY (srx, srr))')
+    return db
+
+
+# function for reading rows (key, value) of table with key in keys
+def _cached(db, table, key, value, keys):
+    rows = []
+    for i in range(0, len(keys), SQLITE_BATCH):
+        batch = keys[i:i+SQLITE_BATCH]
+        rows += db.execute('SELECT ' + key + ', ' + value + ' FROM ' + table + ' WHERE ' + key +
+                ' IN (' + ','.join(['?'] * len(batch)) + ')', batch).fetchall()
+    return rows
+
+
+# function for posting a request to an E-utility, returns the streamed response
+def _post(session, utility, params, base=EUTILS, timeout=120):
+    if API_KEY is not None:
+        params = dict(params, api_key=API_KEY)
+    response = session.post(base + utility, data=params, stream=True, timeout=timeout)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    time.sleep(DELAY)
+    return response
+
+
+# function for finding uids of records with the accessions in db
+def esearch(session, db, accessions, base=EUTILS):
+    term = ' OR '.join(accession + '[ACCN]' for accession in accessions)
+    with _post(session, 'esearch.fcgi', {'db': db, 'term': term, 'retmax': 100000}, base=base) as response:
+        return [elem.text for event, elem in ET.iterparse(response.raw) if elem.tag == 'Id']
+
+
+# function for streaming document summaries (version 2.0) of uids in db
+# yields each DocumentSummary element, which is cleared afterwards
+def esummary(session, db, uids, base=EUTILS):
+    if len(uids) == 0:
+        return
+    params = {'db': db, 'id': ','.join(uids), 'version': '2.0'}
+    with _post(session, 'esummary.fcgi', params, base=base) as response:
+        for event, elem in ET.iterparse(response.raw):
+            if elem.tag == 'DocumentSummary':
+                yield elem
+                elem.clear()
+
+
+# function for parsing (GSM, SRX) pairs from gds document summaries
+def parse_gds(summaries):
+    for summary in summaries:
+        gsm = summary.findtext('Accession')
+        for target in summary.iter('TargetObject'):
+            if target.text:
+                yield gsm, target.text
+
+
+# function for parsing (SRX, SRR) pairs from sra document summaries
+# ExpXml and Runs are xml fragments escaped as text
+def parse_sra(summaries):
+    for summary in summaries:
+        expxml = ET.fromstring('<ExpXml>' + (summary.findtext('ExpXml') or '') + '</ExpXml>')
+        runs = ET.fromstring('<Runs>' + (summary.findtext('Runs') or '') + '</Runs>')
+        experiment = expxml.find('Experiment')
+        if experiment is None:
+            continue
+        for run in runs.iter('Run'):
+            yield experiment.get('acc'), run.get('acc')
+
+
+# function for resolving GSM accessions to SRX accessions: {GSM: SRX}
+# if a sample has several SRA relations, the last one is taken; unresolved accessions are left out
+def resolve_srx(GSMs, batch_size=200, cachefile=CACHE, base=EUTILS, session=None):
+    GSMs = list(dict.fromkeys(GSMs))
+    db = open_cache(cachefile)
+    Mapping = dict(_cached(db, 'gsm_srx', 'gsm', 'srx', GSMs))
+    missing = [GSM for GSM in GSMs if not GSM in Mapping]
+    session = create_session() if session is None else session
+
+    for i in range(0, len(missing), batch_size):
+        batch = set(missing[i:i+batch_size])
+        print("Resolving SRX of " + str(len(batch)) + " GSM accessions (" + str(i + len(batch)) + "/" + str(len(missing)) + ")")
+        found = dict()
+        uids = esearch(session, 'gds', batch, base=base)
+        for gsm, srx in parse_gds(esummary(session, 'gds', uids, base=base)):
+            if gsm in batch:
+                found[gsm] = srx
+        with db:
+            db.executemany('INSERT OR REPLACE INTO gsm_srx VALUES (?, ?)', found.items())
+        Mapping.update(found)
+
+    db.close()
+    return Mapping
+
+
+# function for resolving SRX accessions to SRR accessions: {SRX: [SRR, ...]}
+def resolve_srr(SRXs, batch_size=200, cachefile=CACHE, base=EUTILS, session=None):
+    SRXs = list(dict.fromkeys(SRXs))
+    db = open_cache(cachefile)
+    Mapping = dict()
+    for srx, srr in _cached(db, 'srx_srr', 'srx', 'srr', SRXs):
+        Mapping.setdefault(srx, []).append(srr)
+    missing = [SRX for SRX in SRXs if not SRX in Mapping]
+    session = create_session() if session is None else session
+
+    for i in range(0, len(missing), batch_size):
+        batch = set(missing[i:i+batch_size])
+        print("Resolving SRR of " + str(len(batch)) + " SRX accessions (" + str(i + len(batch)) + "/" + str(len(missing)) + ")")
+        found = set()
+        uids = esearch(session, 'sra', batch, base=base)
+        for srx, srr in parse_sra(esummary(session, 'sra', uids, base=base)):
+            if srx in batch:
+                found.add((srx, srr))
+        with db:
+            db.executemany('INSERT OR REPLACE INTO srx_srr VALUES (?, ?)', sorted(found))
+        for srx, srr in sorted(found):
+            Mapping.setdefault(srx, []).append(srr)
+
+    db.close()
+    return dict((srx, sorted(set(srrs))) for srx, srrs in Mapping.items())
+
+
+# function for resolving GSM (or SRX) accessions to SRR accessions: {accession: [SRR, ...]}
+def resolve_runs(accessions, batch_size=200, cachefile=CACHE, base=EUTILS, session=None):
+    session = create_session() if session is None else session
+    GSMs = [accession for accession in accessions if accession.startswith('GSM')]
+    SRX = resolve_srx(GSMs, batch_size=batch_size, cachefile=cachefile, base=base, session=session)
+    Experiments = dict((accession, SRX.get(accession) if accession.startswith('GSM') else accession)
+            for accession in accessions)
+
+    Runs = resolve_srr([srx for srx in Experiments.values() if srx is not None],
+            batch_size=batch_size, cachefile=cachefile, base=base, session=session)
+    return dict((accession, Runs.get(srx, [])) for accession, srx in Experiments.items())
@@ -0,0 +1,133 @@
+"""In-memory interval index for overlap, count, nearest and all-hits queries.
+
+Intervals are indexed once per chromosome as numpy arrays sorted by start,
+together with the sorted ends and the running maximum of ends (an implicit
+interval tree). Queries are given as arrays of (chroms, starts, ends) and
+answered in batches by binary search, returning index arrays that refer to
+rows of the indexed intervals, without temporary files or bedtools calls.
+"""
+
+import numpy as np
+from util_bed import chrom_groups
+
+
+# function for indexing intervals (chroms, starts, ends): {chrom: arrays of the chromosome}
+def build_index(chroms, starts, ends):
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    Index = dict()
+    for chrom, ind in chrom_groups(chroms).items():
+        ind = ind[np.lexsort((ends[ind], starts[ind]))]
+        s = starts[ind]
+        e = ends[ind]
+        runmax = np.maximum.accumulate(e)
+        position = np.arange(len(ind))
+        Index[chrom] = {
+                'rows': ind,
+                'starts': s,
+                'ends': e,
+                'runmax': runmax,
+                'runarg': np.maximum.accumulate(np.where(e == runmax, position, 0)),
+                'sorted_ends': np.sort(e),
+                }
+    return Index
+
+
+# function for applying func(entry, query rows, qstarts, qends) to queries grouped by chromosome
+def _by_chrom(Index, chroms, starts, ends, func):
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    for chrom, ind in chrom_groups(chroms).items():
+        if chrom in Index:
+            func(Index[chrom], ind, starts[ind], ends[ind])
+
+
+# number of indexed intervals overlapping each query
+def count_overlaps(Index, chroms, starts, ends):
+    counts = np.zeros(len(starts), dtype=np.int64)
+
+    def count(entry, ind, qstarts, qends):
+        counts[ind] = np.searchsorted(entry['starts'], qends, side='left') - \
+                np.searchsorted(entry['sorted_ends'], qstarts, side='right')
+
+    _by_chrom(Index, chroms, starts, ends, count)
+    return counts
+
+
+# whether each query overlaps any indexed interval
+def any_overlap(Index, chroms, starts, ends):
+    return count_overlaps(Index, chroms, starts, ends) > 0
+
+
+# total base pairs of indexed intervals overlapping each query
+# from the integral of interval depth: D(x) = sum(min(x, end) - start) over start < x
+def overlap_bp(Index, chroms, starts, ends):
+    bp = np.zeros(len(starts), dtype=np.int64)
+
+    def integral(entry, ind, qstarts, qends):
+        if not 'cumstart' in entry:
+            entry['cumstart'] = np.r_[0, np.cumsum(entry['starts'])]
+            entry['cumend'] = np.r_[0, np.cumsum(entry['sorted_ends'])]
+
+        def depth_integral(x):
+            ns = np.searchsorted(entry['starts'], x, side='left')
+            ne = np.searchsorted(entry['sorted_ends'], x, side='left')
+            return (ns * x - entry['cumstart'][ns]) - (ne * x - entry['cumend'][ne])
+
+        bp[ind] = depth_integral(qends) - depth_integral(qstarts)
+
+    _by_chrom(Index, chroms, starts, ends, integral)
+    return bp
+
+
+# all pairs of (query index, indexed interval index) that overlap, sorted by query
+def all_hits(Index, chroms, starts, ends):
+    queries = []
+    hits = []
+
+    def collect(entry, ind, qstarts, qends):
+        # candidates: intervals starting before qend, after the last one whose running max end <= qstart
+        hi = np.searchsorted(entry['starts'], qends, side='left')
+        lo = np.searchsorted(entry['runmax'], qstarts, side='right')
+        lengths = np.maximum(hi - lo, 0)
+        q = np.repeat(np.arange(len(ind)), lengths)
+        cand = np.repeat(lo, lengths) + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        keep = entry['ends'][cand] > qstarts[q]
+        queries.append(ind[q[keep]])
+        hits.append(entry['rows'][cand[keep]])
+
+    _by_chrom(Index, chroms, starts, ends, collect)
+    if len(queries) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    queries = np.concatenate(queries)
+    hits = np.concatenate(hits)
+    order = np.lexsort((hits, queries))
+    return queries[order], hits[order]
+
+
+# nearest indexed interval of each query and its distance in bp (0 if overlapping)
+# -1 for queries on chromosomes without indexed intervals; ties are resolved to the upstream one
+def nearest(Index, chroms, starts, ends):
+    nearest = np.full(len(starts), -1, dtype=np.int64)
+    distance = np.full(len(starts), -1, dtype=np.int64)
+
+    def closest(entry, ind, qstarts, qends):
+        n = len(entry['starts'])
+        k = np.searchsorted(entry['starts'], qends, side='left')
+        prev = np.maximum(k - 1, 0)
+        # upstream: interval with the largest end among those starting before qend
+        left = np.where(k > 0, entry['runarg'][prev], -1)
+        leftgap = np.where(k > 0, np.maximum(qstarts - entry['runmax'][prev], 0), np.iinfo(np.int64).max)
+        # downstream: first interval starting at or after qend
+        right = np.where(k < n, k, -1)
+        rightgap = np.where(k < n, entry['starts'][np.minimum(k, n - 1)] - qends, np.iinfo(np.int64).max)
+
+        useleft = leftgap <= rightgap
+        pick = np.where(useleft, left, right)
+        nearest[ind] = entry['rows'][pick]
+        distance[ind] = np.where(useleft, leftgap, rightgap)
+
+    _by_chrom(Index, chroms, starts, ends, closest)
+    return nearest, distance
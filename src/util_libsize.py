@@ -0,0 +1,59 @@
+"""Obtain library depth (number of mapped reads) of bam files.
+
+Mapped read counts are taken from index statistics (idxstats) if the bam file
+is indexed (bai/csi), otherwise reads are counted by streaming the file.
+Results are cached on disk in a json file, keyed by absolute path, file size
+and modification time of the bam file, so that repeated runs over the same
+bam files do not read them again.
+
+The cache file can be specified with the LIBSIZE_CACHE environment variable
+(default: ~/.cache/chipseq_analysis/libsize.json).
+"""
+
+import os
+import pysam
+import concurrent.futures as cf
+from util_cache import load_json, save_json
+
+CACHE = os.environ.get('LIBSIZE_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'chipseq_analysis', 'libsize.json'))
+
+
+def cache_key(Bamfile):
+    stat = os.stat(Bamfile)
+    return os.path.abspath(Bamfile) + ':' + str(stat.st_size) + ':' + str(int(stat.st_mtime))
+
+
+# function for counting mapped reads of a bam file
+def mapped_reads(Bamfile):
+    with pysam.AlignmentFile(Bamfile, 'rb') as bam:
+        if bam.has_index():
+            return sum(stat.mapped for stat in bam.get_index_statistics())
+
+    return int(pysam.view('-c', '-F', '4', Bamfile).strip())
+
+
+def _mapped_reads(Bamfile, order):
+    return mapped_reads(Bamfile), order
+
+
+# function for obtaining library sizes of bam files (in the order of Bamfiles)
+def library_sizes(Bamfiles, max_workers=15, cachefile=CACHE):
+    cache = load_json(cachefile, 'library size cache')
+    keys = [cache_key(Bamfile) for Bamfile in Bamfiles]
+    Nreads = [cache.get(key) for key in keys]
+
+    missing = [order for order in range(len(Bamfiles)) if Nreads[order] is None]
+    if len(missing) > 0:
+        futures = []
+        with cf.ProcessPoolExecutor(max_workers=max_workers) as e:
+            for order in missing:
+                futures.append(e.submit(_mapped_reads, Bamfiles[order], order))
+
+            for future in cf.as_completed(futures):
+                read, order = future.result()
+                Nreads[order] = read
+
+        save_json(dict((keys[order], Nreads[order]) for order in missing), cachefile)
+
+    return [float(read) for read in Nreads]
@@ -0,0 +1,150 @@
+"""Write and read site x sample matrices (coverage or occupancy) with their sites.
+
+Matrices are written in one of the formats:
+
+    tsv       bed columns of sites followed by a column per sample, as text
+    npy       a directory with the matrix as a column-major matrix.npy, the
+              sites as a SiteTable (sites/) and the sample names (samples.json)
+    parquet   bed columns of sites and a column per sample, in row groups
+
+Rows are written block by block, so that the matrix is never copied into a
+DataFrame as a whole. A npy matrix is opened memory-mapped, and a column of a
+sample is contiguous on disk; parquet files are read column by column, so that
+only the samples asked for are loaded.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from util_bed import SiteTable, BED_COLUMNS
+
+FORMATS = ['tsv', 'npy', 'parquet']
+
+# number of sites written at once (and in a row group of parquet)
+CHUNK_ROWS = 100000
+
+
+# function for guessing format of a matrix written by write_matrix
+def matrix_format(path):
+    if os.path.isdir(path):
+        return 'npy'
+    if path.endswith('.parquet') or path.endswith('.pq'):
+        return 'parquet'
+    return 'tsv'
+
+
+# function for writing (SiteTable, site x sample matrix) into Outfile in format
+def write_matrix(Outfile, Sites, matrix, samples, format='tsv', chunk_rows=CHUNK_ROWS):
+    if not format in FORMATS:
+        raise ValueError("Unknown format: " + format + " , should be either of " + ', '.join(FORMATS))
+    if matrix.shape != (len(Sites), len(samples)):
+        raise ValueError("Matrix of shape " + str(matrix.shape) + " does not match " +
+                str(len(Sites)) + " sites and " + str(len(samples)) + " samples")
+
+    if format == 'npy':
+        write_npy(Outfile, Sites, matrix, samples)
+    elif format == 'parquet':
+        write_parquet(Outfile, Sites, matrix, samples, chunk_rows=chunk_rows)
+    else:
+        write_tsv(Outfile, Sites, matrix, samples, chunk_rows=chunk_rows)
+
+
+def _block(Sites, matrix, samples, lo, hi, dtype=None):
+    df = Sites[lo:hi].to_dataframe()
+    for i, sample in enumerate(samples):
+        df[sample] = matrix[lo:hi, i] if dtype is None else matrix[lo:hi, i].astype(dtype)
+    return df
+
+
+# binary (bool) matrices are written as 0/1
+def write_tsv(Outfile, Sites, matrix, samples, chunk_rows=CHUNK_ROWS):
+    dtype = np.uint8 if matrix.dtype == bool else None
+    with open(Outfile, 'w') as f:
+        for lo in range(0, max(len(Sites), 1), chunk_rows):
+            _block(Sites, matrix, samples, lo, lo+chunk_rows, dtype).to_csv(f, sep='\t',
+                    header=lo == 0, index=False)
+
+
+# matrix is stored in column-major (Fortran) order, and filled sample by sample
+def write_npy(Outdir, Sites, matrix, samples):
+    if not os.path.exists(Outdir):
+        os.makedirs(Outdir)
+    out = np.lib.format.open_memmap(os.path.join(Outdir, 'matrix.npy'), mode='w+',
+            dtype=matrix.dtype, shape=matrix.shape, fortran_order=True)
+    for i in range(matrix.shape[1]):
+        out[:, i] = matrix[:, i]
+    out.flush()
+    del out
+
+    Sites.save(os.path.join(Outdir, 'sites'))
+    with open(os.path.join(Outdir, 'samples.json'), 'w') as f:
+        json.dump([str(sample) for sample in samples], f)
+
+
+def write_parquet(Outfile, Sites, matrix, samples, chunk_rows=CHUNK_ROWS):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for lo in range(0, max(len(Sites), 1), chunk_rows):
+            df = _block(Sites, matrix, samples, lo, lo+chunk_rows)
+            if writer is None:
+                # sample names are kept in the schema, to tell them from columns of sites
+                schema = pa.Schema.from_pandas(df, preserve_index=False)
+                schema = schema.with_metadata(dict(schema.metadata or {},
+                        samples=json.dumps([str(sample) for sample in samples])))
+                writer = pq.ParquetWriter(Outfile, schema)
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# function for reading a matrix written by write_matrix, returns (SiteTable, site x sample matrix, samples)
+# only columns of the given samples are read if samples is given
+# npy matrices are memory-mapped unless mmap_mode is None
+def read_matrix(path, samples=None, mmap_mode='r'):
+    format = matrix_format(path)
+    if format == 'npy':
+        with open(os.path.join(path, 'samples.json')) as f:
+            allsamples = json.load(f)
+        Sites = SiteTable.load(os.path.join(path, 'sites'), mmap_mode=mmap_mode)
+        matrix = np.load(os.path.join(path, 'matrix.npy'), mmap_mode=mmap_mode)
+        if samples is None:
+            return Sites, matrix, allsamples
+        return Sites, matrix[:, _sample_index(allsamples, samples)], list(samples)
+
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(path)
+        allsamples = json.loads(schema.metadata[b'samples'].decode())
+        bedcolumns = schema.names[:len(schema.names)-len(allsamples)]
+        read = lambda columns: pq.read_table(path, columns=columns).to_pandas()
+    else:
+        header = list(pd.read_csv(path, sep='\t', header=0, nrows=0).columns)
+        bedcolumns = _bed_columns(header)
+        allsamples = header[len(bedcolumns):]
+        read = lambda columns: pd.read_csv(path, sep='\t', header=0, usecols=columns,
+                dtype={'chrom': str})[columns]
+
+    samples = allsamples if samples is None else list(samples)
+    _sample_index(allsamples, samples)
+    df = read(bedcolumns + samples)
+    return SiteTable.from_dataframe(df[bedcolumns]), df[samples].values, samples
+
+
+# leading columns of a tsv header named as bed columns (by read_bed) are columns of sites
+def _bed_columns(header):
+    Nbed = 0
+    while Nbed < len(header) and (header[Nbed] in BED_COLUMNS or header[Nbed].isdigit()):
+        Nbed += 1
+    return header[:Nbed]
+
+
+def _sample_index(allsamples, samples):
+    missing = [sample for sample in samples if not sample in allsamples]
+    if len(missing) > 0:
+        raise ValueError("Samples not found in the matrix: " + ', '.join(missing))
+    return [allsamples.index(sample) for sample in samples]
@@ -0,0 +1,192 @@
+"""Cache and query the ChIP-ATLAS experiment table.
+
+The experiment table (experimentList.tab) is downloaded and parsed once and
+kept in a local cache directory as Parquet (or pickle if no Parquet engine
+is installed), with CellType, Antigen and assembly stored as categoricals.
+On later runs the table is only downloaded again if the server reports a
+change (ETag / Last-Modified), or if a local table file was modified.
+
+Keyword filters over the metadata columns are answered by an inverted index
+from word tokens to rows. A keyword made of word characters only matches the
+same rows as str.contains, since it can only occur within a single token;
+other keywords (spaces, punctuation, regular expressions) fall back to
+scanning the columns with str.contains.
+
+The cache directory can be specified with the ATLAS_CACHE environment
+variable (default: ~/.cache/chipseq_analysis/chipatlas).
+"""
+
+import os
+import re
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from tempfile import NamedTemporaryFile as temp
+
+TABLE = 'http://dbarchive.biosciencedbc.jp/kyushu-u/metadata/experimentList.tab'
+CACHE = os.environ.get('ATLAS_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'chipseq_analysis', 'chipatlas'))
+
+COLUMNS = ['ID', 'assembly', 'AntigenClass', 'Antigen', 'CellTypeClass', 'CellType',
+        'CellDescription', 'ProcessLog', 'Title', 'MetaDataByAuthor',
+        'MetaData2', 'MetaData3', 'MetaData4']
+CATEGORIES = ['CellType', 'Antigen', 'assembly']
+META_COLUMNS = ['MetaDataByAuthor', 'MetaData2', 'MetaData3', 'MetaData4']
+
+TOKEN = re.compile(r'\w+')
+
+
+# function for parsing the experiment table
+def parse_table(tableName):
+    table = pd.read_csv(tableName, sep='\t', usecols=range(0,13),
+            header=None, names=COLUMNS)
+    for column in CATEGORIES:
+        table[column] = table[column].astype('category')
+    return table
+
+
+# function for building inverted index of word tokens in the metadata columns
+# returns (sorted tokens, row pointers, rows) in compressed sparse row layout
+def token_index(table, columns=META_COLUMNS):
+    text = pd.concat([table[column] for column in columns], axis=0, ignore_index=False)
+    tokens = text.dropna().astype(str).str.findall(TOKEN.pattern).explode().dropna()
+    pairs = pd.DataFrame({'token': tokens.values, 'row': tokens.index.values}).drop_duplicates()
+
+    codes, vocab = pd.factorize(pairs.token, sort=True)
+    order = np.argsort(codes, kind='stable')
+    indptr = np.searchsorted(codes[order], np.arange(len(vocab)+1))
+    rows = pairs.row.values[order].astype(np.int64)
+    return np.asarray(vocab, dtype=object), indptr, rows
+
+
+# function for selecting rows with any metadata column containing keyword (as str.contains)
+def keyword_rows(table, Index, keyword, columns=META_COLUMNS):
+    if TOKEN.fullmatch(keyword) is None:
+        match = np.zeros(len(table), dtype=bool)
+        for column in columns:
+            match |= table[column].str.contains(keyword).fillna(False).values.astype(bool)
+        return match
+
+    vocab, indptr, rows = Index
+    match = np.zeros(len(table), dtype=bool)
+    for i in np.where(pd.Series(vocab).str.contains(keyword, regex=False).values)[0]:
+        match[rows[indptr[i]:indptr[i+1]]] = True
+    return match
+
+
+# function for selecting rows by cell type, antigen and keywords (any of them)
+def select(table, Index, celltype=None, antigen=None, keywords=None):
+    selected = np.ones(len(table), dtype=bool)
+    if celltype is not None:
+        selected &= (table.CellType == celltype).values
+    if antigen is not None:
+        selected &= (table.Antigen == antigen).values
+    if keywords is not None:
+        match = np.zeros(len(table), dtype=bool)
+        for keyword in keywords:
+            match |= keyword_rows(table, Index, keyword)
+        selected &= match
+    return selected
+
+
+def _cache_files(tableName, cachedir):
+    key = hashlib.md5(os.path.abspath(tableName).encode() if os.path.exists(tableName)
+            else tableName.encode()).hexdigest()
+    return os.path.join(cachedir, key + '.json'), os.path.join(cachedir, key)
+
+
+# version of the table (ETag / Last-Modified of url, or size and mtime of local file)
+# returns None if unchanged from the cached version (meta), and the response to be parsed otherwise
+def _check_table(tableName, meta, session=None, timeout=60):
+    if os.path.exists(tableName):
+        stat = os.stat(tableName)
+        version = {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+        return (None if meta.get('version') == version else tableName), version
+
+    from util_download import create_session
+    session = create_session(1) if session is None else session
+    headers = dict()
+    if 'etag' in meta.get('version', {}):
+        headers['If-None-Match'] = meta['version']['etag']
+    if 'last_modified' in meta.get('version', {}):
+        headers['If-Modified-Since'] = meta['version']['last_modified']
+    response = session.get(tableName, headers=headers, stream=True, timeout=timeout)
+    if response.status_code == 304:
+        response.close()
+        return None, meta['version']
+    response.raise_for_status()
+
+    version = dict()
+    if 'ETag' in response.headers:
+        version['etag'] = response.headers['ETag']
+    if 'Last-Modified' in response.headers:
+        version['last_modified'] = response.headers['Last-Modified']
+    return response, version
+
+
+def _save(table, Index, base):
+    try:
+        table.to_parquet(base + '.parquet')
+        tablefile = base + '.parquet'
+    except ImportError:
+        table.to_pickle(base + '.pkl')
+        tablefile = base + '.pkl'
+    vocab, indptr, rows = Index
+    np.savez(base + '.index.npz', vocab=vocab.astype(str), indptr=indptr, rows=rows)
+    return tablefile
+
+
+def _load(meta, base):
+    if meta['file'].endswith('.parquet'):
+        table = pd.read_parquet(meta['file'])
+    else:
+        table = pd.read_pickle(meta['file'])
+    with np.load(base + '.index.npz') as npz:
+        Index = (npz['vocab'].astype(object), npz['indptr'], npz['rows'])
+    return table, Index
+
+
+# function for loading the experiment table with its token index, from cache if up to date
+# with refresh=False, the cached table is used without checking for updates
+def load_table(tableName=TABLE, cachedir=CACHE, refresh=True, session=None):
+    metafile, base = _cache_files(tableName, cachedir)
+    meta = dict()
+    if os.path.isfile(metafile):
+        with open(metafile) as f:
+            meta = json.load(f)
+        if not os.path.isfile(meta.get('file', '')):
+            meta = dict()
+
+    if len(meta) > 0 and not refresh:
+        print("Using cached table: " + meta['file'])
+        return _load(meta, base)
+
+    try:
+        source, version = _check_table(tableName, meta, session=session)
+    except IOError as e:
+        if len(meta) == 0:
+            raise
+        print("Could not check table for updates, using cached table: " + str(e))
+        return _load(meta, base)
+
+    if source is None:
+        print("Table is not modified, using cached table: " + meta['file'])
+        return _load(meta, base)
+
+    print("Parsing table: " + tableName)
+    if isinstance(source, str):
+        table = parse_table(source)
+    else:
+        with source:
+            source.raw.decode_content = True
+            table = parse_table(source.raw)
+    Index = token_index(table)
+
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+    meta = {'table': tableName, 'version': version, 'file': _save(table, Index, base)}
+    with temp('w', dir=cachedir, delete=False) as f:
+        json.dump(meta, f)
+    os.replace(f.name, metafile)
+    return table, Index
@@ -0,0 +1,48 @@
+"""Write and read (Sample, Coordinate, Position) coverage arrays in netcdf.
+
+Coverage is written block by block into a chunked, zlib-compressed NETCDF4
+variable as soon as each block is computed, so that the whole array never
+has to be held in memory. The output can be opened lazily as a dask-backed
+xarray dataset.
+"""
+
+import numpy as np
+
+# default number of sites in a chunk of the netcdf variable
+CHUNK_SITES = 1000
+
+
+# function for creating a netcdf file with an empty Coverage variable
+def create_coverage(Outfile, samples, Ncoord, Npos, dtype='float32', chunk_sites=CHUNK_SITES, complevel=4):
+    import netCDF4
+
+    ds = netCDF4.Dataset(str(Outfile), 'w', format='NETCDF4')
+    ds.createDimension('Sample', len(samples))
+    ds.createDimension('Coordinate', Ncoord)
+    ds.createDimension('Position', Npos)
+
+    sample = ds.createVariable('Sample', str, ('Sample',))
+    for i, name in enumerate(samples):
+        sample[i] = str(name)
+
+    ds.createVariable('Coverage', np.dtype(dtype), ('Sample', 'Coordinate', 'Position'),
+            zlib=True, complevel=complevel,
+            chunksizes=(1, max(1, min(chunk_sites, Ncoord)), max(1, Npos)))
+    return ds
+
+
+# function for writing a (Coordinate, Position) block of a sample from the site lo
+# values are rounded and clipped to the range of integer dtypes
+def write_block(ds, order, lo, block):
+    var = ds.variables['Coverage']
+    dtype = var.dtype
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        block = np.clip(np.rint(block), info.min, info.max)
+    var[order, lo:lo+block.shape[0], :block.shape[1]] = block.astype(dtype)
+
+
+# function for opening coverage lazily as a dask-backed xarray dataset
+def open_coverage(FileName, chunk_sites=10000):
+    import xarray as xa
+    return xa.open_dataset(FileName, chunks={'Sample': 1, 'Coordinate': chunk_sites})
@@ -0,0 +1,66 @@
+"""Normalize read count matrices.
+
+Takes a (site, sample) matrix of raw read counts along with site lengths and
+library sizes, and returns the normalized matrix computed with broadcasted
+numpy operations over the whole matrix.
+
+Supported measures:
+    Raw         raw read counts
+    CPM         counts per million mapped reads
+    FPKM        fragments per kilobase of site per million mapped reads
+    TPM         transcripts (reads) per kilobase per million, scaled per sample
+    SizeFactor  counts divided by median-of-ratios size factors (DESeq)
+"""
+
+import numpy as np
+
+MEASURES = ['Raw', 'CPM', 'FPKM', 'TPM', 'SizeFactor']
+
+
+# median-of-ratios size factors of samples (columns), using sites observed in all samples
+def size_factors(counts):
+    counts = np.asarray(counts, dtype=np.float64)
+    observed = np.all(counts > 0, axis=1)
+    if not observed.any():
+        raise ValueError("No sites with positive counts in all samples to estimate size factors")
+
+    logcounts = np.log(counts[observed, :])
+    logratio = logcounts - logcounts.mean(axis=1)[:, np.newaxis]
+    return np.exp(np.median(logratio, axis=0))
+
+
+# counts: (site, sample) matrix, lengths: (site,) in bp, libsizes: (sample,) mapped reads
+# if base is given, log(x+1) with the base is returned
+def normalize(counts, lengths=None, libsizes=None, measure='FPKM', base=None, dtype=np.float64):
+    if not measure in MEASURES:
+        raise ValueError("Unknown measure: " + str(measure) + " , should be either of " + ', '.join(MEASURES))
+
+    mat = np.array(counts, dtype=dtype)
+    if measure in ['FPKM', 'TPM']:
+        if lengths is None:
+            raise ValueError(measure + " requires lengths of sites")
+        lengths = np.asarray(lengths, dtype=dtype)
+    if measure in ['CPM', 'FPKM']:
+        if libsizes is None:
+            raise ValueError(measure + " requires library sizes")
+        libsizes = np.asarray(libsizes, dtype=dtype)
+
+    if measure == 'CPM':
+        mat *= (1e6 / libsizes)[np.newaxis, :]
+    elif measure == 'FPKM':
+        mat *= (1e9 / libsizes)[np.newaxis, :]
+        mat /= lengths[:, np.newaxis]
+    elif measure == 'TPM':
+        mat *= (1e3 / lengths)[:, np.newaxis]
+        # samples without reads in any site are left as 0
+        total = mat.sum(axis=0)
+        mat *= 1e6 / np.where(total > 0, total, 1)[np.newaxis, :]
+    elif measure == 'SizeFactor':
+        mat /= size_factors(counts).astype(dtype)[np.newaxis, :]
+
+    if base is not None:
+        np.log1p(mat, out=mat)
+        if base != np.e:
+            mat /= np.log(base)
+
+    return mat
@@ -0,0 +1,235 @@
+"""Measure occupancy of multiple bed files in reference regions.
+
+Each bed file is read once into an interval index (util_interval) and
+overlaps with all reference regions are resolved at once by binary search
+on the sorted start and end coordinates, instead of running bedtools
+coverage for every bed file.
+
+Modes:
+    Binary   1 if any interval of the bed file overlaps the region
+    Count    number of intervals of the bed file overlapping the region
+    Overlap  total number of overlapping base pairs
+
+For all-vs-all comparison of bed files, the genome is cut into elementary
+segments at the start and end positions of intervals of all files, each file
+is represented as a packed bitset over the segments it covers, and shared
+base pairs of all pairs of files are summed over bit-ANDs weighted by the
+segment lengths. For correlation of occupancy profiles, intervals of all
+files are merged into clusters (as the union from bedtools cat), the
+(cluster, file) occupancy is kept as a sparse matrix and pearson (phi)
+correlation is derived from its column sums and Gram matrix.
+"""
+
+import numpy as np
+from util_bed import read_bed
+from util_interval import build_index, count_overlaps, overlap_bp
+from util_parallel import create_shared, attach_shared, site_chunks, run_units
+
+MODES = ['Binary', 'Count', 'Overlap']
+
+
+# function for measuring occupancy of bed files in reference regions (chroms, starts, ends)
+# returns (region, bed file) matrix, bit-packed along bed files if packed (Binary only)
+def occupancy_matrix(chroms, starts, ends, Bedfiles, mode='Binary', packed=False):
+    if not mode in MODES:
+        raise ValueError("Unknown occupancy mode: " + str(mode))
+
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    dtype = {'Binary': bool, 'Count': np.int32, 'Overlap': np.int64}[mode]
+    occupancy = np.zeros((len(starts), len(Bedfiles)), dtype=dtype)
+
+    for i, Bedfile in enumerate(Bedfiles):
+        print("Checking occupancy of " + Bedfile + " in Reference bed")
+        bed = read_bed(Bedfile, coords_only=True)
+        Index = build_index(bed.chrom.values, bed.start.values, bed.end.values)
+        if mode == 'Overlap':
+            occupancy[:, i] = overlap_bp(Index, chroms, starts, ends)
+        else:
+            occupancy[:, i] = count_overlaps(Index, chroms, starts, ends)
+
+    if packed and mode == 'Binary':
+        return np.packbits(occupancy, axis=1)
+    return occupancy
+
+
+# offset separating chromosomes when coordinates of all chromosomes are put on one axis
+CHROM_OFFSET = 2**40
+
+
+# function for reading coordinates of all bed files, returns (chroms, starts, ends, file index)
+def read_beds(Bedfiles):
+    beds = [read_bed(Bedfile, coords_only=True) for Bedfile in Bedfiles]
+    fileid = np.repeat(np.arange(len(beds)), [len(bed) for bed in beds])
+    chroms = np.concatenate([bed.chrom.values.astype(str) for bed in beds])
+    starts = np.concatenate([bed.start.values for bed in beds])
+    ends = np.concatenate([bed.end.values for bed in beds])
+    return chroms, starts, ends, fileid
+
+
+# function for placing intervals of all chromosomes (sorted by name) on one genome axis
+def to_axis(chroms, starts, ends):
+    names, codes = np.unique(np.asarray(chroms).astype(str), return_inverse=True)
+    offset = codes.astype(np.int64) * CHROM_OFFSET
+    return names, starts + offset, ends + offset
+
+
+# function for converting intervals on the genome axis back to (chroms, starts, ends)
+def from_axis(names, starts, ends):
+    codes = starts // CHROM_OFFSET
+    return names[codes], starts - codes * CHROM_OFFSET, ends - codes * CHROM_OFFSET
+
+
+# function for merging intervals into clusters of overlapping (or book-ended) intervals
+# returns clusters (starts, ends) on the genome axis sorted by position, and cluster index of each interval
+def merge_clusters(starts, ends):
+    order = np.lexsort((ends, starts))
+    s = starts[order]
+    e = ends[order]
+
+    runmax = np.maximum.accumulate(e)
+    new = np.ones(len(s), dtype=bool)
+    new[1:] = s[1:] > runmax[:-1]
+    first = np.where(new)[0]
+
+    cluster = np.zeros(len(order), dtype=np.int64)
+    cluster[order] = np.cumsum(new) - 1
+    if len(first) == 0:
+        return (s, e), cluster
+    return (s[first], np.maximum.reduceat(e, first)), cluster
+
+
+# function for depth (number of overlapping intervals) along the genome axis
+# returns segments (starts, ends, depth) of constant depth, covering all positions with depth > 0
+def depth_segments(starts, ends):
+    positions, inverse = np.unique(np.r_[starts, ends], return_inverse=True)
+    delta = np.bincount(inverse, weights=np.r_[np.ones(len(starts)), -np.ones(len(ends))],
+            minlength=len(positions))
+    depth = np.cumsum(delta)[:-1].astype(np.int64)
+    segstart = positions[:-1]
+    segend = positions[1:]
+    covered = depth > 0
+    return segstart[covered], segend[covered], depth[covered]
+
+
+# function for representing each file as a packed bitset over elementary segments
+# (between consecutive start/end positions of intervals of all files), set where the file covers the segment
+# returns (bitsets, segment lengths)
+def segment_bitsets(starts, ends, fileid, Nfiles):
+    positions = np.sort(np.r_[starts, ends])
+    distinct = np.ones(len(positions), dtype=bool)
+    distinct[1:] = positions[1:] != positions[:-1]
+    positions = positions[distinct]
+    Nsegments = max(len(positions) - 1, 0)
+
+    bitsets = np.zeros((Nfiles, (Nsegments + 7) // 8), dtype=np.uint8)
+    order = np.argsort(fileid, kind='stable')
+    bounds = np.searchsorted(fileid[order], np.arange(Nfiles+1))
+    for i in range(Nfiles):
+        rows = order[bounds[i]:bounds[i+1]]
+        # segments [first, last) covered by each merged interval of the file
+        (mstarts, mends), cluster = merge_clusters(starts[rows], ends[rows])
+        first = np.searchsorted(positions, mstarts)
+        lengths = np.searchsorted(positions, mends) - first
+        covered = np.zeros(Nsegments, dtype=bool)
+        covered[np.arange(lengths.sum()) + np.repeat(first - np.cumsum(lengths) + lengths, lengths)] = True
+        bitsets[i, :] = np.packbits(covered)
+    return bitsets, np.diff(positions).astype(np.float64)
+
+
+# function for summing weights of shared bits of row pairs ([lo, hi) with rows after them)
+# only non-zero bytes of the bit-ANDs are unpacked and multiplied with the weights of their bits
+def intersection_unit(shm_name, weight_name, shape, lo, hi, block=64):
+    shm, bitsets = attach_shared(shm_name, shape, np.uint8)
+    wshm, weights = attach_shared(weight_name, (shape[1], 8), np.float64)
+    counts = np.zeros((hi - lo, shape[0]), dtype=np.float64)
+    for i in range(lo, hi):
+        # only bytes where row i has bits set can be shared
+        nonzero = np.flatnonzero(bitsets[i])
+        row = bitsets[i, nonzero]
+        for j in range(i, shape[0], block):
+            shared = np.bitwise_and(row, bitsets[j:j+block, nonzero])
+            rows, cols = np.nonzero(shared)
+            bits = np.unpackbits(shared[rows, cols][:, np.newaxis], axis=1)
+            counts[i-lo, j:j+shared.shape[0]] = np.bincount(rows,
+                    weights=(bits * weights[nonzero[cols]]).sum(axis=1), minlength=shared.shape[0])
+    shm.close()
+    wshm.close()
+    return lo, counts
+
+
+# function for summing weights of shared bits (e.g. shared base pairs of segments) of all pairs of files
+# rows of the bitsets are split over max_workers processes sharing the bitsets in memory
+def pairwise_intersections(bitsets, weights, max_workers=1):
+    Nfiles = bitsets.shape[0]
+    counts = np.zeros((Nfiles, Nfiles), dtype=np.float64)
+    shm, shared = create_shared(bitsets.shape, np.uint8)
+    shared[:] = bitsets
+    # weights are padded to the packed length, with zero weights for padding bits of the last byte
+    wshm, wshared = create_shared((bitsets.shape[1], 8), np.float64)
+    wshared.ravel()[:len(weights)] = weights
+    try:
+        if max_workers <= 1:
+            counts[:] = intersection_unit(shm.name, wshm.name, bitsets.shape, 0, Nfiles)[1]
+        else:
+            units = [(shm.name, wshm.name, bitsets.shape, lo, hi) for lo, hi in site_chunks(Nfiles, 4*max_workers)]
+            for lo, block in run_units(intersection_unit, units, max_workers=max_workers):
+                counts[lo:lo+block.shape[0], :] = block
+    finally:
+        for block in [shm, wshm]:
+            block.close()
+            block.unlink()
+
+    return np.triu(counts) + np.triu(counts, 1).T
+
+
+# function for building sparse (cluster, file) occupancy matrix in CSC format
+def sparse_occupancy(cluster, fileid, Nfiles, Nclusters):
+    from scipy import sparse
+    occupancy = sparse.csc_matrix((np.ones(len(cluster), dtype=np.int64), (cluster, fileid)),
+            shape=(Nclusters, Nfiles))
+    occupancy.sum_duplicates()
+    occupancy.data[:] = 1
+    return occupancy
+
+
+# function for pearson (phi) correlation between columns of a sparse binary matrix
+# computed from column sums and co-occurrence counts (Gram matrix)
+def sparse_correlation(occupancy):
+    n = float(occupancy.shape[0])
+    sums = np.asarray(occupancy.sum(axis=0), dtype=np.float64).ravel()
+    gram = (occupancy.T @ occupancy).toarray().astype(np.float64)
+
+    cov = gram - np.outer(sums, sums) / n
+    var = sums - np.square(sums) / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return cov / np.sqrt(np.outer(var, var))
+
+
+# function for measuring pairwise similarity of bed files
+# overlap: shared base pairs / base pairs covered by the smaller of the two files,
+# jaccard: shared base pairs / base pairs covered by either file,
+# correlation: pearson correlation of occupancy over all clusters (union of intervals of all files)
+# overlap and jaccard of a pair of files do not depend on the other files given
+def pairwise_similarity(Bedfiles, measure='overlap', max_workers=1):
+    chroms, starts, ends, fileid = read_beds(Bedfiles)
+    names, starts, ends = to_axis(chroms, starts, ends)
+
+    if measure == 'correlation':
+        clusters, cluster = merge_clusters(starts, ends)
+        Nclusters = len(clusters[0])
+        print("Total " + str(Nclusters) + " clusters of intervals were identified")
+        occupancy = sparse_occupancy(cluster, fileid, len(Bedfiles), Nclusters)
+        return sparse_correlation(occupancy)
+
+    bitsets, lengths = segment_bitsets(starts, ends, fileid, len(Bedfiles))
+    print("Total " + str(len(lengths)) + " segments between interval boundaries were identified")
+    shared = pairwise_intersections(bitsets, lengths, max_workers=max_workers)
+    sizes = np.diag(shared)
+
+    if measure == 'jaccard':
+        mat = shared / np.maximum(sizes[:, np.newaxis] + sizes[np.newaxis, :] - shared, 1)
+    else:
+        mat = shared / np.maximum(np.minimum(sizes[:, np.newaxis], sizes[np.newaxis, :]), 1)
+    np.fill_diagonal(mat, 1)
+    return mat
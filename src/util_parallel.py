@@ -0,0 +1,52 @@
+"""Run (file, chunk-of-sites) work units across a process pool.
+
+Work units are spread over a pool of processes, and the workers write their
+results into a preallocated numpy array in shared memory, so that no result
+has to be pickled back to the main process.
+"""
+
+import itertools
+import numpy as np
+import concurrent.futures as cf
+from multiprocessing import shared_memory
+
+
+# function for allocating a zero-filled array in shared memory
+def create_shared(shape, dtype=np.float32):
+    size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    array[:] = 0
+    return shm, array
+
+
+# function for attaching an array in shared memory from a worker
+def attach_shared(name, shape, dtype=np.float32):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+# function for splitting Nsites sites into (start, end) of Nchunks chunks
+# if align is given, chunk boundaries are placed at multiples of align
+def site_chunks(Nsites, Nchunks=1, align=None):
+    Nchunks = max(1, min(Nchunks, Nsites))
+    if align is None:
+        bounds = np.linspace(0, Nsites, Nchunks+1).astype(int)
+    else:
+        size = int(np.ceil(Nsites / float(Nchunks) / align)) * align
+        bounds = np.r_[np.arange(0, Nsites, max(size, 1)), Nsites]
+    return [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+# function for running func(*unit) for all units, yields results as completed
+# at most 2*max_workers units are in flight, so that results are not accumulated
+def run_units(func, units, max_workers=1):
+    units = iter(units)
+    with cf.ProcessPoolExecutor(max_workers=max_workers) as e:
+        pending = set(e.submit(func, *unit) for unit in itertools.islice(units, 2*max_workers))
+        while pending:
+            done, pending = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+            for future in done:
+                for unit in itertools.islice(units, 1):
+                    pending.add(e.submit(func, *unit))
+                yield future.result()
@@ -1,10 +1,92 @@
-from subprocess import PIPE, Popen
-from urllib.request import urlopen, Request
-from bs4 import BeautifulSoup
-import urllib.request
+from bs4 import BeautifulSoup, SoupStrainer
+from collections import deque
+import concurrent.futures as cf
+import time
 import os
+from util_cache import load_json, save_json
+from util_download import create_session
+from util_entrez import resolve_srx, resolve_runs, EUTILS, CACHE as ENTREZ_CACHE
 
-def get_paths(IDs, PATH_DATA, ext="bam"):
+LISTING_CACHE = os.environ.get('LISTING_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'chipseq_analysis', 'listings.json'))
+
+
+# function for building Aho-Corasick automaton of patterns: (transitions, failure links, outputs)
+def build_automaton(patterns):
+    goto = [dict()]
+    output = [[]]
+    for pattern in patterns:
+        state = 0
+        for char in pattern:
+            if not char in goto[state]:
+                goto.append(dict())
+                output.append([])
+                goto[state][char] = len(goto) - 1
+            state = goto[state][char]
+        output[state].append(pattern)
+
+    # failure links in breadth-first order
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, child in goto[state].items():
+            queue.append(child)
+            back = fail[state]
+            while back and not char in goto[back]:
+                back = fail[back]
+            fail[child] = goto[back][char] if char in goto[back] and goto[back][char] != child else 0
+            output[child] = output[child] + output[fail[child]]
+    return goto, fail, output
+
+
+# function for finding all patterns of the automaton occurring in text
+def find_patterns(automaton, text):
+    goto, fail, output = automaton
+    found = set()
+    state = 0
+    for char in text:
+        while state and not char in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        found.update(output[state])
+    return found
+
+
+# function for obtaining links (href of <a> tags) in the listing at PATH
+def read_listing(session, PATH, timeout=60):
+    response = session.get(PATH, timeout=timeout)
+    response.raise_for_status()
+    soup = BeautifulSoup(response.content, "html.parser", parse_only=SoupStrainer('a'))
+    return [link.get('href') for link in soup.find_all('a') if link.get('href') is not None]
+
+
+# function for reading listings of PATH_DATA concurrently, reusing cached listings younger than ttl seconds
+def read_listings(PATH_DATA, max_workers=8, ttl=3600, cachefile=LISTING_CACHE, session=None):
+    cache = load_json(cachefile, 'listing cache') if ttl > 0 else dict()
+    now = time.time()
+    Listings = dict((PATH, cache[PATH]['links']) for PATH in PATH_DATA
+            if PATH in cache and now - cache[PATH]['time'] < ttl)
+
+    missing = [PATH for PATH in PATH_DATA if not PATH in Listings]
+    if len(missing) > 0:
+        if session is None:
+            session = create_session(max_workers)
+        with cf.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict((executor.submit(read_listing, session, PATH), PATH) for PATH in missing)
+            for future in cf.as_completed(futures):
+                print("reading path:")
+                print(futures[future])
+                Listings[futures[future]] = future.result()
+                print("..success")
+                print("")
+        if ttl > 0:
+            save_json(dict((PATH, {'time': now, 'links': Listings[PATH]}) for PATH in missing), cachefile)
+
+    return Listings
+
+
+def get_paths(IDs, PATH_DATA, ext="bam", max_workers=8, ttl=3600, cachefile=LISTING_CACHE, session=None):
     # open specified URL
     Files = dict()
     FullPath = dict()
@@ -12,26 +94,19 @@ def get_paths(IDs, PATH_DATA, ext="bam"):
     if isinstance(PATH_DATA, str):
         PATH_DATA = PATH_DATA.split()
 
-    for PATH in list(PATH_DATA):
-        print("reading path:")
-        print(PATH)
-
-        response = Request(PATH)
-        html = urlopen(response)
+    Listings = read_listings(list(PATH_DATA), max_workers=max_workers, ttl=ttl,
+            cachefile=cachefile, session=session)
 
-        print("..success")
-        print("")
-
-        # find the link for files
-        print("find specified files...")
-        soup = BeautifulSoup(html.read(), "html.parser")
-
-        for link in soup.find_all('a'):
-            name = link.get('href')
-            for ID in IDs:
-                if ID in name and name.endswith(ext):
-                    Files[ID] = name
-                    FullPath[Files[ID].split('.')[0]] = PATH + name
+    # find the link for files, containing any of IDs
+    print("find specified files...")
+    automaton = build_automaton(set(IDs))
+    for PATH in list(PATH_DATA):
+        for name in Listings[PATH]:
+            if not name.endswith(ext):
+                continue
+            for ID in find_patterns(automaton, name):
+                Files[ID] = name
+                FullPath[Files[ID].split('.')[0]] = PATH + name
 
     # check if all specified files can be found
     for ID in IDs:
@@ -41,24 +116,12 @@ def get_paths(IDs, PATH_DATA, ext="bam"):
     return Files, FullPath
 
 
-def query_SRX(GSM_ACC, path_ncbitoolkit='/home/NFS/users/yo.kim/lib/softwares/edirect/'):
-    p1 = Popen([path_ncbitoolkit + "esearch", "-db", "gds", "-query", '"' + GSM_ACC  +'"'],stdout=PIPE)
-    p2 = Popen([path_ncbitoolkit + "efetch", "-format", "docsum"], stdin=p1.stdout, stdout=PIPE)
-    p1.stdout.close()
-    p3 = Popen([path_ncbitoolkit + "xtract", "-pattern", "ExtRelations", "-element", "TargetObject"],
-                stdin = p2.stdout, stdout = PIPE)
-    p2.stdout.close()
-    tmp = p3.communicate()[0].decode("utf-8").split('\n')
-    return tmp[len(tmp)-2]
-
-def query_SRR(GSM_ACC, path_ncbitoolkit='/home/NFS/users/yo.kim/lib/softwares/edirect/'):
-    p1 = Popen([path_ncbitoolkit + "esearch", "-db", "sra", "-query", '"' + GSM_ACC  +'"'],stdout=PIPE)
-    p2 = Popen([path_ncbitoolkit + "efetch", "-format", "docsum"], stdin=p1.stdout, stdout=PIPE)
-    p1.stdout.close()
-    p3 = Popen([path_ncbitoolkit + "xtract", "-pattern", "DocumentSummary", "-element", "Run@acc"],
-                stdin = p2.stdout, stdout = PIPE)
-    p2.stdout.close()
-    tmp = p3.communicate()[0].decode("utf-8").split('\t')
-    return list(set(tmp)-set(['']))
-
+# function for obtaining SRX accession of a GSM accession ('' if not found)
+# use util_entrez.resolve_srx for many accessions at once
+def query_SRX(GSM_ACC, cachefile=ENTREZ_CACHE, base=EUTILS):
+    return resolve_srx([GSM_ACC], cachefile=cachefile, base=base).get(GSM_ACC, '')
 
+# function for obtaining SRR accessions of a GSM (or SRX) accession
+# use util_entrez.resolve_runs for many accessions at once
+def query_SRR(GSM_ACC, cachefile=ENTREZ_CACHE, base=EUTILS):
+    return resolve_runs([GSM_ACC], cachefile=cachefile, base=base)[GSM_ACC]
@@ -0,0 +1,159 @@
+"""Extract binned read coverage profiles of genomic sites from bam or bigwig files.
+
+Reads are fetched with pysam once per block of neighbouring sites, optionally
+extended toward the 3' end to the fragment size, and piled up with numpy
+difference arrays (cumulative sum). Coverage of each site is then summarized
+into fixed bins, producing a (Coordinate, Position) matrix in the same layout
+as metaseq's genomic_signal(...).array(...).
+
+Signals of bigwig files are read in-process with pyBigWig, once per block of
+sites, and summarized into the same matrix layout.
+"""
+
+import numpy as np
+from util_bed import chrom_groups
+from util_readcount import open_bam
+
+# maximum length of a block of sites piled up at once
+MAX_BLOCK = 1000000
+
+
+# function for fetching reads in [start, end) as (start, end) arrays,
+# reads are extended by fragSize toward the 3' end if specified
+def read_intervals(bam, chrom, start, end, fragSize=None):
+    pad = 0 if fragSize is None else fragSize
+    rstart = []
+    rend = []
+    reverse = []
+    for read in bam.fetch(chrom, max(0, start-pad), end+pad):
+        if read.is_unmapped or read.reference_end is None:
+            continue
+        rstart.append(read.reference_start)
+        rend.append(read.reference_end)
+        reverse.append(read.is_reverse)
+
+    rstart = np.asarray(rstart, dtype=np.int64)
+    rend = np.asarray(rend, dtype=np.int64)
+    if fragSize is not None:
+        reverse = np.asarray(reverse, dtype=bool)
+        rstart = np.where(reverse, rend - fragSize, rstart)
+        rend = rstart + fragSize
+
+    return rstart, rend
+
+
+# function for calculating per-base coverage of [start, end) from read intervals
+def pileup(rstart, rend, start, end):
+    length = end - start
+    rstart = np.clip(rstart - start, 0, length)
+    rend = np.clip(rend - start, 0, length)
+    diff = np.bincount(rstart, minlength=length+1) - np.bincount(rend, minlength=length+1)
+    return np.cumsum(diff[:length])
+
+
+# function for summarizing profiles (site, position) into bins by mean or max
+def bin_profile(profile, bins, stat='mean'):
+    width = profile.shape[1]
+    if bins is None or bins == width:
+        return profile
+
+    edges = (np.arange(bins) * width) // bins
+    if stat == 'max':
+        return np.maximum.reduceat(profile, edges, axis=1)
+
+    sizes = np.maximum(np.diff(np.r_[edges, width]), 1)
+    return np.add.reduceat(profile, edges, axis=1) / sizes
+
+
+# function for splitting sorted sites of a chromosome into blocks of neighbouring sites
+def site_blocks(starts, ends, max_block=MAX_BLOCK):
+    blocks = []
+    lo = 0
+    blockend = ends[0] if len(starts) > 0 else 0
+    for i in range(1, len(starts)):
+        if starts[i] > blockend or ends[i] - starts[lo] > max_block:
+            blocks.append((lo, i))
+            lo = i
+            blockend = ends[i]
+        else:
+            blockend = max(blockend, ends[i])
+    if len(starts) > 0:
+        blocks.append((lo, len(starts)))
+    return blocks
+
+
+# function for extracting coverage profiles of sites (chroms, starts, ends) from a bam file
+# returns (Coordinate, Position) array, Position = bins or the longest site
+def profile_bam(Bamfile, chroms, starts, ends, bins=None, fragSize=None, stat='mean', out=None):
+    chroms = np.asarray(chroms)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    Npos = bins if bins is not None else int((ends - starts).max())
+    if out is None:
+        out = np.zeros((len(starts), Npos), dtype=np.float32)
+
+    bam = open_bam(Bamfile)
+    contigs = set(bam.references)
+
+    for chrom, ind in chrom_groups(chroms).items():
+        if chrom not in contigs:
+            continue
+        ind = ind[np.argsort(starts[ind], kind='stable')]
+        for lo, hi in site_blocks(starts[ind], ends[ind]):
+            sites = ind[lo:hi]
+            blockstart = int(starts[sites].min())
+            blockend = int(ends[sites].max())
+            rstart, rend = read_intervals(bam, chrom, blockstart, blockend, fragSize)
+            cov = pileup(rstart, rend, blockstart, blockend)
+
+            widths = ends[sites] - starts[sites]
+            if np.all(widths == widths[0]):
+                offset = (starts[sites] - blockstart)[:, np.newaxis] + np.arange(widths[0])
+                profile = bin_profile(cov[offset], bins, stat)
+                out[sites, :profile.shape[1]] = profile
+            else:
+                for site in sites:
+                    profile = cov[starts[site]-blockstart:ends[site]-blockstart][np.newaxis, :]
+                    profile = bin_profile(profile, bins, stat)
+                    out[site, :profile.shape[1]] = profile
+    bam.close()
+
+    return out
+
+
+# function for extracting signal profiles of sites (chroms, starts, ends) from a bigwig file
+# positions without signal are set to 0, returns (Coordinate, Position) array
+def profile_bigwig(BigWig, chroms, starts, ends, bins=None, stat='mean', out=None):
+    import pyBigWig
+
+    chroms = np.asarray(chroms)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    Npos = bins if bins is not None else int((ends - starts).max())
+    if out is None:
+        out = np.zeros((len(starts), Npos), dtype=np.float32)
+
+    bw = pyBigWig.open(BigWig)
+    chromsizes = bw.chroms()
+
+    for chrom, ind in chrom_groups(chroms).items():
+        if chrom not in chromsizes:
+            continue
+        ind = ind[np.argsort(starts[ind], kind='stable')]
+        for lo, hi in site_blocks(starts[ind], ends[ind]):
+            sites = ind[lo:hi]
+            blockstart = int(starts[sites].min())
+            blockend = int(ends[sites].max())
+            signal = np.zeros(blockend - blockstart, dtype=np.float32)
+            fetchend = min(blockend, chromsizes[chrom])
+            if fetchend > blockstart:
+                signal[:fetchend-blockstart] = bw.values(chrom, blockstart, fetchend, numpy=True)
+            signal[np.isnan(signal)] = 0
+
+            for site in sites:
+                profile = signal[starts[site]-blockstart:ends[site]-blockstart][np.newaxis, :]
+                profile = bin_profile(profile, bins, stat)
+                out[site, :profile.shape[1]] = profile
+    bw.close()
+
+    return out
@@ -0,0 +1,111 @@
+"""Count reads overlapping genomic sites in multiple bam files.
+
+Sites are parsed once into sorted per-chromosome coordinate arrays, and reads
+of each bam file are counted with indexed region fetches (pysam), so that
+counts are written directly into a numpy array instead of going through
+bedtools coverage and per-site Interval objects.
+"""
+
+import numpy as np
+import pysam
+import concurrent.futures as cf
+from util_bed import chrom_groups
+
+
+# function for building sorted coordinate arrays of sites (chroms, starts, ends) for each chromosome
+# returns {chrom: (row indices, starts, ends)} sorted by start, and site lengths
+def site_index(chroms, starts, ends):
+    chroms = np.asarray(chroms)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    Index = dict()
+    for chrom, ind in chrom_groups(chroms).items():
+        ind = ind[np.lexsort((ends[ind], starts[ind]))]
+        Index[chrom] = (ind, starts[ind], ends[ind])
+
+    return Index, ends - starts
+
+
+# function for opening bam file, the index is generated if it does not exist
+def open_bam(Bamfile):
+    bam = pysam.AlignmentFile(Bamfile, 'rb')
+    if not bam.has_index():
+        print("No index found for " + Bamfile + ", indexing..")
+        bam.close()
+        pysam.index(Bamfile)
+        bam = pysam.AlignmentFile(Bamfile, 'rb')
+    return bam
+
+
+# function for making sure that all bam files are indexed before they are shared by workers
+def index_bams(Bamfiles):
+    for Bamfile in Bamfiles:
+        open_bam(Bamfile).close()
+
+
+# reads counted by both methods: mapped reads with aligned positions
+def is_counted(read):
+    return not read.is_unmapped and read.reference_end is not None
+
+
+# count reads overlapping sorted sites on a chromosome by one sweep:
+# overlapping sites are merged into blocks and reads of each block are fetched once
+def sweep_counts(bam, chrom, starts, ends):
+    counts = np.zeros(len(starts), dtype=np.int64)
+    blockend = np.maximum.accumulate(ends)
+    breaks = np.where(starts[1:] > blockend[:-1])[0] + 1
+    for lo, hi in zip(np.r_[0, breaks], np.r_[breaks, len(starts)]):
+        rstart = []
+        rend = []
+        for read in bam.fetch(chrom, int(starts[lo]), int(blockend[hi-1])):
+            if is_counted(read):
+                rstart.append(read.reference_start)
+                rend.append(read.reference_end)
+        if len(rstart) == 0:
+            continue
+        # reads overlapping [s, e) = (reads starting before e) - (reads ending before s)
+        rstart = np.sort(np.asarray(rstart, dtype=np.int64))
+        rend = np.sort(np.asarray(rend, dtype=np.int64))
+        counts[lo:hi] = np.searchsorted(rstart, ends[lo:hi], side='left') - \
+                np.searchsorted(rend, starts[lo:hi], side='right')
+    return counts
+
+
+# function for counting reads of a bam file in the indexed sites
+def count_bam(Bamfile, Index, Nsites, order=0, method='fetch'):
+    counts = np.zeros(Nsites, dtype=np.int64)
+    bam = open_bam(Bamfile)
+    contigs = set(bam.references)
+
+    for chrom in Index:
+        ind, starts, ends = Index[chrom]
+        if chrom not in contigs:
+            continue
+        if method == 'sweep':
+            counts[ind] = sweep_counts(bam, chrom, starts, ends)
+        else:
+            counts[ind] = [bam.count(chrom, int(s), int(e), read_callback=is_counted)
+                    for s, e in zip(starts, ends)]
+    bam.close()
+
+    return order, counts
+
+
+# function for counting reads of multiple bam files, returns (site, bam) array
+def count_reads(Index, Nsites, Bamfiles, max_workers=15, method='fetch'):
+    if not method in ['fetch', 'sweep']:
+        raise ValueError("Unknown counting method: " + method)
+
+    index_bams(Bamfiles)
+    counts = np.zeros((Nsites, len(Bamfiles)), dtype=np.int64)
+    futures = []
+    with cf.ProcessPoolExecutor(max_workers=max_workers) as e:
+        for order in range(len(Bamfiles)):
+            futures.append(e.submit(count_bam, Bamfiles[order], Index, Nsites, order, method))
+
+        for future in cf.as_completed(futures):
+            order, read = future.result()
+            counts[:, order] = read
+
+    return counts
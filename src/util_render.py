@@ -0,0 +1,53 @@
+"""Render scatter plots of many points at a fixed cost.
+
+Points are drawn either as one rasterized point layer, or aggregated to a
+fixed grid of bins (hexbin or 2D histogram), so that plotting time and the
+size of vector outputs (pdf, svg) do not grow with the number of points.
+Text labels are thinned to at most one label per cell of a coarse grid.
+"""
+
+import numpy as np
+from matplotlib.colors import LogNorm
+
+RENDERS = ['points', 'hexbin', 'hist2d']
+
+
+# function for drawing points (x, y) on an axis
+# points: rasterized scatter, hexbin/hist2d: log-scaled counts in gridsize bins per axis
+def render_points(ax, x, y, render='points', gridsize=100, color='k', cmap='Greys', **kwargs):
+    if not render in RENDERS:
+        raise ValueError("Unknown render mode: " + str(render))
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if render == 'hexbin':
+        return ax.hexbin(x, y, gridsize=gridsize, mincnt=1, bins='log', cmap=cmap, rasterized=True)
+    elif render == 'hist2d':
+        return ax.hist2d(x, y, bins=gridsize, cmin=1, norm=LogNorm(), cmap=cmap, rasterized=True)[3]
+    return ax.scatter(x, y, color=color, rasterized=True, **kwargs)
+
+
+# function for drawing marginal histograms of (x, y) on the marginal axes of a joint grid
+def render_marginals(grid, x, y, bins=100, color='k'):
+    grid.ax_marg_x.hist(np.asarray(x, dtype=float), bins=bins, color=color)
+    grid.ax_marg_y.hist(np.asarray(y, dtype=float), bins=bins, color=color, orientation='horizontal')
+
+
+# function for selecting points to be labeled, in order of priority (higher first)
+# at most one label per cell of a grid x grid partition of the plot range, and max_labels in total
+def thin_labels(x, y, priority, grid=50, max_labels=None):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    order = np.argsort(-np.asarray(priority, dtype=float), kind='stable')
+
+    if grid > 0 and len(x) > 0:
+        def cells(v):
+            span = max(v.max() - v.min(), np.finfo(float).eps)
+            return np.minimum(((v - v.min()) / span * grid).astype(np.int64), grid - 1)
+        cell = cells(x)[order] * grid + cells(y)[order]
+        order = order[np.unique(cell, return_index=True)[1]]
+        order = order[np.argsort(-np.asarray(priority, dtype=float)[order], kind='stable')]
+
+    if max_labels is not None:
+        order = order[:max_labels]
+    return order
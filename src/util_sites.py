@@ -0,0 +1,104 @@
+"""Prepare site sets from bed files, with an on-disk cache.
+
+Sites used by the coverage scripts are prepared in one stage:
+
+    union    sites of all bed files merged into clusters of overlapping (or
+             book-ended) sites, as BedTool.cat; otherwise sites are taken as-is
+    window   +/- window bp around the midpoint of each site, clipped to the
+             chromosome sizes of the genome (as midpoint + slop)
+    sort     sites sorted by chromosome order (e.g. of a bam header) and start
+
+The result is a SiteTable, saved (as .npy arrays of chromosome codes, starts,
+ends and other bed columns) in a directory whose name is a hash of the
+contents of the bed files and the parameters of the stage, so that later runs
+over the same bed files load it memory-mapped instead of preparing the sites
+again.
+
+The cache directory can be specified with the SITES_CACHE environment
+variable (default: ~/.cache/chipseq_analysis/sites).
+"""
+
+import os
+import json
+import hashlib
+import shutil
+import pandas as pd
+from tempfile import mkdtemp
+from util_bed import SiteTable, read_bed, chrom_sizes, midpoint_window
+from util_occupancy import read_beds
+
+CACHE = os.environ.get('SITES_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'chipseq_analysis', 'sites'))
+
+
+def file_digest(path, chunk_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# key of prepared sites: hash of the contents of the bed files and the parameters
+# (and of the contents of the genome file, if chromosome sizes are given in a file)
+def cache_key(Bedfiles, union, window, genome, chrom_order):
+    if window is None:
+        genome = None
+    elif os.path.isfile(genome):
+        genome = file_digest(genome)
+    params = [[file_digest(Bedfile) for Bedfile in Bedfiles], union, window, genome, chrom_order]
+    return hashlib.sha1(json.dumps(params).encode()).hexdigest()
+
+
+# function for obtaining chromosome names in the order of the header of a bam file
+def bam_chroms(Bamfile):
+    import pysam
+    with pysam.AlignmentFile(Bamfile, 'rb') as bam:
+        return list(bam.references)
+
+
+# function for preparing sites (SiteTable) of bed files
+# union: merge sites of the bed files, otherwise sites (with all bed columns) are concatenated as-is
+# window, genome: +/- window bp around the midpoint of sites, if window is given
+# chrom_order: sort sites by chromosome order and start, if given
+def prepare_sites(Bedfiles, union=True, window=None, genome=None, chrom_order=None, cachedir=CACHE):
+    if isinstance(Bedfiles, str):
+        Bedfiles = [Bedfiles]
+    chrom_order = None if chrom_order is None else list(chrom_order)
+
+    cachepath = None
+    if cachedir is not None:
+        cachepath = os.path.join(cachedir, cache_key(Bedfiles, union, window, genome, chrom_order))
+        if os.path.isdir(cachepath):
+            print("Loading prepared sites from " + cachepath)
+            return SiteTable.load(cachepath)
+
+    for Bedfile in Bedfiles:
+        print("Obtaining " + Bedfile)
+    if union:
+        print("Obtaining unions of binding sites")
+        Sites = SiteTable.from_arrays(*read_beds(Bedfiles)[:3]).merge()
+    else:
+        Sites = SiteTable.from_dataframe(pd.concat([read_bed(Bedfile) for Bedfile in Bedfiles],
+            ignore_index=True))
+
+    if window is not None:
+        print("Identifying +/- " + str(window) + "bp from center of sites (" + str(genome) + ")")
+        starts, ends = midpoint_window(Sites.chroms, Sites.starts, Sites.ends, window, chrom_sizes(genome))
+        Sites = SiteTable(Sites.names, Sites.codes, starts, ends, Sites.columns)
+
+    if chrom_order is not None:
+        print("Sorting sites in the order of chromosomes")
+        Sites = Sites.sort(chrom_order)
+
+    if cachepath is not None:
+        # saved to a temporary directory first, so that an incomplete cache is never loaded
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        tmpdir = mkdtemp(dir=cachedir)
+        Sites.save(tmpdir)
+        try:
+            os.rename(tmpdir, cachepath)
+        except OSError:
+            shutil.rmtree(tmpdir)
+    return Sites